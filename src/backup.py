@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Backup - Online, compressed snapshots of habits.db
+#
+# The snapshot is taken with the SQLite backup API a few pages at a time,
+# pausing between steps, so the monitor and the dialogs can keep writing
+# and reading while a large database is copied.
+
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from config import CONFIG_DIR
+from database import Database
+
+BACKUP_DIR = os.path.join(CONFIG_DIR, 'backups')
+
+# Pages copied per backup step and pause between steps (seconds)
+PAGES_PER_STEP = 64
+STEP_SLEEP = 0.01
+
+BACKUP_PATTERN = 'habits-*.db.gz'
+
+
+def pause(status, remaining, total):
+    """Backup progress callback, sleeping between steps"""
+    time.sleep(STEP_SLEEP)
+
+
+class Backup(object):
+    """Create and rotate compressed snapshots of the database"""
+
+    def __init__(self, db=None, directory=BACKUP_DIR, keep=7):
+        """
+        Args:
+            db: Database to back up (defaults to the user database)
+            directory: Where snapshots are stored
+            keep: Number of snapshots to keep (0 keeps all)
+        """
+        self.db = db if db is not None else Database()
+        self.directory = directory
+        self.keep = keep
+
+    def run(self):
+        """Take a snapshot and rotate old ones
+
+        Returns:
+            Path of the new snapshot
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, 0o700)
+
+        name = time.strftime('habits-%Y%m%d-%H%M%S.db.gz', time.localtime())
+        filename = os.path.join(self.directory, name)
+        # Unique names, so two backups running at once do not collide
+        handle, snapshot = tempfile.mkstemp(prefix='.snapshot-',
+                                            suffix='.db', dir=self.directory)
+        os.close(handle)
+        handle, part = tempfile.mkstemp(prefix='.habits-', suffix='.part',
+                                        dir=self.directory)
+        os.close(handle)
+        try:
+            source = self.db.connect()
+            target = sqlite3.connect(snapshot)
+            try:
+                source.backup(target, pages=PAGES_PER_STEP,
+                              progress=pause)
+            finally:
+                target.close()
+                source.close()
+
+            with open(snapshot, 'rb') as fin, gzip.open(part, 'wb') as fout:
+                shutil.copyfileobj(fin, fout)
+            os.replace(part, filename)
+        finally:
+            os.remove(snapshot)
+            if os.path.exists(part):
+                os.remove(part)
+
+        self.rotate()
+        return filename
+
+    def list(self):
+        """Existing snapshots, oldest first"""
+        return sorted(glob.glob(os.path.join(self.directory, BACKUP_PATTERN)))
+
+    def rotate(self):
+        """Delete the oldest snapshots beyond self.keep"""
+        if not self.keep or self.keep <= 0:
+            return []
+        removed = self.list()[:-self.keep]
+        for filename in removed:
+            os.remove(filename)
+        return removed
+
+
+if __name__ == '__main__':
+    print(Backup().run())
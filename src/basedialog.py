@@ -30,13 +30,16 @@ try:
 except ValueError as e:
     print(e)
     exit(1)
-from gi.repository import Gdk, Gtk
+from gi.repository import Gdk, GLib, Gtk
+from threading import Thread
+import time
 import config
+from downsample import follows_live, LIVE_UPDATE_SECONDS
 
 
 class BaseDialog(Gtk.Dialog):
     def __init__(self, title, window=None, ok_button=True, cancel_button=True,
-                 modal=True, resizable=False):
+                 modal=True, resizable=False, visible=True):
         Gtk.Dialog.__init__(self, title, window)
         self.set_modal(modal)
         self.set_destroy_with_parent(True)
@@ -54,8 +57,14 @@ class BaseDialog(Gtk.Dialog):
             self.set_type_hint(Gdk.WindowTypeHint.DIALOG)
         self.set_icon_from_file(config.ICON)
         self.connect('realize', self.on_realize)
+        # Loads started by load_async; bumped to drop results no one wants
+        self.load_generation = 0
+        self.placeholder = None
+        self.connect('hide', self.cancel_load)
+        self.connect('destroy', self.cancel_load)
         self.init_ui()
-        self.show_all()
+        if visible:
+            self.show_all()
 
     def init_ui(self):
         vbox0 = Gtk.VBox(spacing=5)
@@ -80,6 +89,57 @@ class BaseDialog(Gtk.Dialog):
         self.grid.set_margin_top(10)
         frame1.add(self.grid)
 
+    def load_async(self, fetch, callback):
+        """Call fetch() on a worker thread, then callback(result) on the
+        GTK thread
+
+        The result is dropped if the dialog was hidden or destroyed, or a
+        newer load was started, before it arrived.
+        """
+        self.load_generation += 1
+        generation = self.load_generation
+
+        def deliver(result):
+            if generation == self.load_generation:
+                callback(result)
+            return False
+
+        def worker():
+            try:
+                result = fetch()
+            except Exception as e:
+                print('Error loading data: {}'.format(e))
+                return
+            GLib.idle_add(deliver, result)
+
+        Thread(target=worker, daemon=True).start()
+
+    def cancel_load(self, *_):
+        self.load_generation += 1
+
+    def start_loading(self, fetch, populate):
+        """Show a placeholder now and populate(data) once fetch() is done"""
+        self.placeholder = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL,
+                                   spacing=10)
+        self.placeholder.set_halign(Gtk.Align.CENTER)
+        self.placeholder.set_valign(Gtk.Align.CENTER)
+        self.placeholder.set_hexpand(True)
+        self.placeholder.set_vexpand(True)
+        spinner = Gtk.Spinner()
+        spinner.start()
+        self.placeholder.pack_start(spinner, False, False, 0)
+        self.placeholder.pack_start(Gtk.Label.new('Loading…'), False, False, 0)
+        self.grid.attach(self.placeholder, 0, 0, 1, 1)
+        self.load_async(fetch, populate)
+
+    def show_content(self, widget):
+        """Replace the loading placeholder with widget"""
+        if self.placeholder is not None:
+            self.grid.remove(self.placeholder)
+            self.placeholder = None
+        self.grid.attach(widget, 0, 0, 1, 1)
+        widget.show_all()
+
     def on_realize(self, *_):
         monitor = Gdk.Display.get_primary_monitor(Gdk.Display.get_default())
         scale = monitor.get_scale_factor()
@@ -90,6 +150,70 @@ class BaseDialog(Gtk.Dialog):
         self.move((monitor_width - width)/2, (monitor_height - height)/2)
 
 
+class LiveChartDialog(BaseDialog):
+    """Chart window whose last column follows today's live counters
+
+    Subclasses call set_live_follows() when they draw their data and
+    implement set_live_point(), which may have to append today's column.
+    """
+    def __init__(self, title, live_source=None, visible=True):
+        """live_source: optional callable returning (day, counters) with
+        today's in-memory counters, or None when nothing is tracked.
+        visible: False creates the window hidden"""
+        self.live_source = live_source
+        self.live_timer = None
+        self.live_sent = None
+        self.live_follows = False
+        # Last day of the charted range, None for all time
+        self.end_date = None
+        BaseDialog.__init__(self, title, None, ok_button=False,
+                            cancel_button=False, modal=False,
+                            resizable=True, visible=visible)
+
+    def init_ui(self):
+        BaseDialog.init_ui(self)
+        # Live updates only while the window is shown
+        self.connect('map', self.on_map)
+        self.connect('unmap', self.on_unmap)
+
+    def on_map(self, widget):
+        if self.live_source is not None and self.live_timer is None:
+            self.live_timer = GLib.timeout_add_seconds(LIVE_UPDATE_SECONDS,
+                                                       self.on_live_tick)
+
+    def on_unmap(self, widget):
+        if self.live_timer is not None:
+            GLib.source_remove(self.live_timer)
+            self.live_timer = None
+
+    def set_live_follows(self, days, bucket):
+        """Follow the live counters if the drawn columns end today"""
+        self.live_follows = follows_live(days, bucket,
+                                         time.strftime('%Y-%m-%d'),
+                                         self.end_date)
+        self.live_sent = None
+
+    def on_live_tick(self):
+        """Pass today's counters to set_live_point(), if they changed"""
+        if not self.live_follows:
+            return True
+        live = self.live_source()
+        if live is None:
+            return True
+        day, counters = live
+        point = {'day': day,
+                 'clics': counters.get('clics', 0),
+                 'keys': counters.get('keys', 0)}
+        if point != self.live_sent:
+            self.live_sent = point
+            self.set_live_point(point)
+        return True
+
+    def set_live_point(self, point):
+        """Show point, a dict with day, clics and keys, as the last column"""
+        raise NotImplementedError
+
+
 if __name__ == '__main__':
     dialog = BaseDialog('Test')
     dialog.run()
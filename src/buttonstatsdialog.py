@@ -18,7 +18,10 @@ from database import Database
 class ButtonStatsDialog(BaseDialog):
     """Dialog to show individual mouse button statistics"""
 
-    def __init__(self):
+    def __init__(self, stats=None):
+        """stats: object with the Database read methods, such as
+        LiveStats (defaults to the user database)"""
+        self.stats = stats if stats is not None else Database()
         BaseDialog.__init__(self, 'Mouse Button Statistics', None,
                             ok_button=False, cancel_button=False,
                             modal=False)
@@ -26,10 +29,13 @@ class ButtonStatsDialog(BaseDialog):
 
     def init_ui(self):
         BaseDialog.init_ui(self)
+        self.start_loading(self.fetch_data, self.populate)
 
-        # Get button totals from database
-        db = Database()
-        button_totals = db.get_total_mouse_buttons()
+    def fetch_data(self):
+        """Button totals, read on a worker thread"""
+        return self.stats.get_total_mouse_buttons()
+
+    def populate(self, button_totals):
 
         # Create grid for displaying stats
         grid = Gtk.Grid()
@@ -124,7 +130,7 @@ class ButtonStatsDialog(BaseDialog):
         close_button.set_margin_top(10)
         grid.attach(close_button, 0, row, 2, 1)
 
-        self.grid.attach(grid, 0, 0, 1, 1)
+        self.show_content(grid)
 
     def close(self):
         self.hide()
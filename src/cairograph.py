@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Cairo Graph - Statistics window drawn natively, without WebKit
+#
+# Same interface as Graph (graph.py), but the chart is a Gtk.DrawingArea
+# painted by chart.ColumnChart, so no WebKit web process is started.
+# Selected with the 'chart-renderer' preference.
+
+import gi
+try:
+    gi.require_version('Gtk', '3.0')
+    gi.require_version('Gdk', '3.0')
+except ValueError as e:
+    print(e)
+    exit(1)
+from gi.repository import Gtk
+from gi.repository import Gdk
+from basedialog import LiveChartDialog
+from chart import ColumnChart, Series
+from database import Database
+from downsample import bucket_columns, bucket_subtitle
+import config
+
+
+class CairoGraph(LiveChartDialog):
+    def __init__(self, title='', subtitle='', days='', distance='', clics='',
+                 keys='', live_source=None, visible=True):
+        """live_source and visible: see LiveChartDialog"""
+        self.title = title
+        self.subtitle = subtitle
+        self.days = list(days)
+        self.clics = list(clics)
+        self.keys = list(keys)
+        self.chart = ColumnChart()
+        self.chart_width = None
+        self.highlight = None
+        self.pointer = (0, 0)
+        LiveChartDialog.__init__(self, title, live_source, visible)
+
+    def init_ui(self):
+        LiveChartDialog.init_ui(self)
+
+        self.area = Gtk.DrawingArea()
+        self.area.set_hexpand(True)
+        self.area.set_vexpand(True)
+        self.area.set_size_request(900, 600)
+        self.area.add_events(Gdk.EventMask.POINTER_MOTION_MASK |
+                             Gdk.EventMask.LEAVE_NOTIFY_MASK)
+        self.area.connect('draw', self.on_draw)
+        self.area.connect('motion-notify-event', self.on_motion)
+        self.area.connect('leave-notify-event', self.on_leave)
+        self.grid.attach(self.area, 0, 0, 1, 1)
+
+        self.connect('delete-event', self.on_delete_event)
+
+    def update(self, title=None, subtitle=None, days=None, distance=None,
+               clics=None, keys=None, end_date=None):
+        if days is not None:
+            self.title = title if title is not None else self.title
+            self.subtitle = subtitle if subtitle is not None else \
+                self.subtitle
+            self.days = list(days)
+            self.clics = list(clics)
+            self.keys = list(keys)
+            self.end_date = end_date
+        # Rebuilt for the current width on the next draw
+        self.chart_width = None
+        self.area.queue_draw()
+
+    def build_chart(self, width):
+        """Fill the chart with the data regrouped to fit width"""
+        preferences = dict(config.PARAMS['preferences'])
+        preferences.update(Database().get_all_preferences())
+        days, (clics, keys), bucket = bucket_columns(
+            self.days, [self.clics, self.keys], width)
+        subtitle = bucket_subtitle(self.subtitle, bucket)
+        self.set_live_follows(days, bucket)
+        self.chart.set_data(self.title, subtitle, days, [
+            Series('Clicks', preferences['clics-color'], clics, ' clicks'),
+            Series('Keys', preferences['keys-color'], keys, ' keys'),
+        ])
+        self.chart_width = width
+
+    def on_draw(self, widget, ctx):
+        width = widget.get_allocated_width()
+        height = widget.get_allocated_height()
+        if width != self.chart_width:
+            self.build_chart(width)
+        self.chart.draw(ctx, width, height, self.highlight)
+        if self.highlight is not None:
+            self.chart.draw_tooltip(ctx, self.highlight, self.pointer[0],
+                                    self.pointer[1], width, height)
+        return True
+
+    def on_motion(self, widget, event):
+        self.pointer = (event.x, event.y)
+        highlight = self.chart.index_at(
+            event.x, event.y, widget.get_allocated_width(),
+            widget.get_allocated_height())
+        if highlight is not None or self.highlight is not None:
+            self.highlight = highlight
+            widget.queue_draw()
+
+    def on_leave(self, widget, event):
+        if self.highlight is not None:
+            self.highlight = None
+            widget.queue_draw()
+
+    def set_live_point(self, point):
+        """Copy today's counters into the last column, or append it"""
+        if self.days and point['day'] == self.days[-1]:
+            self.clics[-1] = point['clics']
+            self.keys[-1] = point['keys']
+            self.chart.series[0].values[-1] = point['clics']
+            self.chart.series[1].values[-1] = point['keys']
+        elif not self.days or point['day'] > self.days[-1]:
+            # No column for today yet, or midnight passed while shown
+            self.days.append(point['day'])
+            self.clics.append(point['clics'])
+            self.keys.append(point['keys'])
+            self.chart_width = None
+        else:
+            return
+        self.area.queue_draw()
+
+    def on_delete_event(self, widget, event):
+        self.close_graph()
+        return True
+
+    def open_graph(self):
+        self.show_all()
+        self.present()
+
+    def close_graph(self):
+        self.hide()
+
+
+if __name__ == '__main__':
+    graph = CairoGraph('Titulo', 'Subtitulo',
+                       ['2019-12-25', '2019-12-26', '2019-12-27'],
+                       [25, 30, 35], [50, 60, 70], [1230, 2550, 2600])
+    graph.run()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Chart - Column chart drawn with Cairo
+#
+# Pure pycairo, no GTK: the same code draws into a Gtk.DrawingArea (see
+# cairograph.py) and into image or SVG surfaces without a display. Data
+# comes in as plain columnar lists, one per series.
+
+import math
+from collections import namedtuple
+
+Series = namedtuple('Series', ('name', 'color', 'values', 'suffix'))
+
+FONT = 'Sans'
+TEXT_COLOR = (0.2, 0.2, 0.2)
+GRID_COLOR = (0.9, 0.9, 0.9)
+BACKGROUND = (1, 1, 1)
+
+# Space around the plot area, in pixels
+MARGIN_TOP = 64
+MARGIN_BOTTOM = 96
+MARGIN_LEFT = 20
+MARGIN_RIGHT = 64
+
+# Fractions of a category left empty, as in Highcharts
+GROUP_PADDING = 0.2
+POINT_PADDING = 0.1
+
+# Minimum horizontal distance between two x axis labels
+LABEL_SPACING = 16
+
+
+def parse_color(color):
+    """'#rrggbb' to an (r, g, b) tuple of floats"""
+    color = color.lstrip('#')
+    return tuple(int(color[i:i + 2], 16) / 255.0 for i in (0, 2, 4))
+
+
+def get_ticks(maximum, count=5):
+    """Round steps for the y axis, from 0 to at least maximum"""
+    if maximum <= 0:
+        return [0, 1]
+    raw = maximum / count
+    magnitude = 10 ** math.floor(math.log10(raw))
+    for factor in (1, 2, 2.5, 5, 10):
+        step = factor * magnitude
+        if step >= raw:
+            break
+    ticks = [0]
+    while ticks[-1] < maximum:
+        ticks.append(ticks[-1] + step)
+    return ticks
+
+
+def format_number(value):
+    if value == int(value):
+        return '{:,}'.format(int(value))
+    return '{:,.1f}'.format(value)
+
+
+class ColumnChart(object):
+    """Grouped column chart, one column per series and category"""
+
+    def __init__(self, title='', subtitle='', categories=(), series=()):
+        self.set_data(title, subtitle, categories, series)
+
+    def set_data(self, title, subtitle, categories, series):
+        self.title = title
+        self.subtitle = subtitle
+        self.categories = list(categories)
+        self.series = list(series)
+
+    def get_plot_area(self, width, height):
+        """Return (x, y, width, height) of the plot area"""
+        return (MARGIN_LEFT, MARGIN_TOP,
+                max(1, width - MARGIN_LEFT - MARGIN_RIGHT),
+                max(1, height - MARGIN_TOP - MARGIN_BOTTOM))
+
+    def get_ticks(self):
+        maximum = max((max(s.values) for s in self.series if s.values),
+                      default=0)
+        return get_ticks(maximum)
+
+    def index_at(self, x, y, width, height):
+        """Category under the point (x, y), or None"""
+        px, py, pw, ph = self.get_plot_area(width, height)
+        if not self.categories or not (px <= x < px + pw and
+                                       py <= y <= py + ph):
+            return None
+        return min(len(self.categories) - 1,
+                   int((x - px) * len(self.categories) / pw))
+
+    def draw(self, ctx, width, height, highlight=None):
+        """Draw the whole chart; highlight is a category index or None"""
+        ctx.set_source_rgb(*BACKGROUND)
+        ctx.paint()
+        ctx.select_font_face(FONT)
+        self.draw_titles(ctx, width)
+        px, py, pw, ph = self.get_plot_area(width, height)
+        ticks = self.get_ticks()
+        self.draw_y_axis(ctx, ticks, px, py, pw, ph)
+        if self.categories:
+            if highlight is not None:
+                group = pw / len(self.categories)
+                ctx.set_source_rgba(0.8, 0.85, 0.9, 0.4)
+                ctx.rectangle(px + highlight * group, py, group, ph)
+                ctx.fill()
+            self.draw_columns(ctx, ticks[-1], px, py, pw, ph)
+            self.draw_x_axis(ctx, px, py, pw, ph)
+        self.draw_legend(ctx, width, height)
+
+    def draw_titles(self, ctx, width):
+        ctx.set_source_rgb(*TEXT_COLOR)
+        for text, size, y in ((self.title, 18, 26), (self.subtitle, 12, 46)):
+            if not text:
+                continue
+            ctx.set_font_size(size)
+            extents = ctx.text_extents(text)
+            ctx.move_to((width - extents.width) / 2 - extents.x_bearing, y)
+            ctx.show_text(text)
+
+    def draw_y_axis(self, ctx, ticks, px, py, pw, ph):
+        ctx.set_font_size(11)
+        ctx.set_line_width(1)
+        for tick in ticks:
+            y = round(py + ph - tick * ph / ticks[-1]) + 0.5
+            ctx.set_source_rgb(*GRID_COLOR)
+            ctx.move_to(px, y)
+            ctx.line_to(px + pw, y)
+            ctx.stroke()
+            ctx.set_source_rgb(*TEXT_COLOR)
+            ctx.move_to(px + pw + 6, y + 4)
+            ctx.show_text(format_number(tick))
+
+    def draw_columns(self, ctx, top, px, py, pw, ph):
+        group = pw / len(self.categories)
+        inner = group * (1 - GROUP_PADDING)
+        column = inner / max(1, len(self.series))
+        for s, series in enumerate(self.series):
+            ctx.set_source_rgb(*parse_color(series.color))
+            x0 = px + group * GROUP_PADDING / 2 + s * column + \
+                column * POINT_PADDING / 2
+            w = max(1, column * (1 - POINT_PADDING))
+            for i, value in enumerate(series.values):
+                if value <= 0:
+                    continue
+                h = value * ph / top
+                ctx.rectangle(x0 + i * group, py + ph - h, w, h)
+            ctx.fill()
+
+    def draw_x_axis(self, ctx, px, py, pw, ph):
+        ctx.set_source_rgb(*TEXT_COLOR)
+        ctx.set_line_width(1)
+        ctx.move_to(px, py + ph + 0.5)
+        ctx.line_to(px + pw, py + ph + 0.5)
+        ctx.stroke()
+        ctx.set_font_size(11)
+        group = pw / len(self.categories)
+        every = max(1, int(math.ceil(LABEL_SPACING / group)))
+        for i in range(0, len(self.categories), every):
+            label = str(self.categories[i])
+            extents = ctx.text_extents(label)
+            ctx.save()
+            ctx.translate(px + (i + 0.5) * group, py + ph + 8)
+            # Right aligned and rotated, like the Highcharts labels
+            ctx.rotate(math.radians(-30))
+            ctx.move_to(-extents.width - extents.x_bearing, 8)
+            ctx.show_text(label)
+            ctx.restore()
+
+    def draw_legend(self, ctx, width, height):
+        ctx.set_font_size(12)
+        items = []
+        total = 0
+        for series in self.series:
+            extents = ctx.text_extents(series.name)
+            items.append((series, extents))
+            total += 20 + extents.x_advance + 16
+        x = (width - total) / 2
+        y = height - 16
+        for series, extents in items:
+            ctx.set_source_rgb(*parse_color(series.color))
+            ctx.rectangle(x, y - 10, 12, 12)
+            ctx.fill()
+            ctx.set_source_rgb(*TEXT_COLOR)
+            ctx.move_to(x + 18, y)
+            ctx.show_text(series.name)
+            x += 20 + extents.x_advance + 16
+
+    def draw_tooltip(self, ctx, index, x, y, width, height):
+        """Box with the values of a category, next to (x, y)"""
+        lines = [str(self.categories[index])]
+        for series in self.series:
+            lines.append('{}: {}{}'.format(
+                series.name, format_number(series.values[index]),
+                series.suffix))
+        ctx.select_font_face(FONT)
+        ctx.set_font_size(12)
+        box_width = max(ctx.text_extents(line).x_advance
+                        for line in lines) + 16
+        box_height = 18 * len(lines) + 8
+        # Keep the box inside the chart
+        bx = x + 16 if x + 16 + box_width < width else x - 16 - box_width
+        by = min(max(4, y - box_height / 2), height - box_height - 4)
+        ctx.rectangle(bx, by, box_width, box_height)
+        ctx.set_source_rgba(0.97, 0.97, 0.97, 0.95)
+        ctx.fill_preserve()
+        ctx.set_source_rgb(0.6, 0.6, 0.6)
+        ctx.set_line_width(1)
+        ctx.stroke()
+        for i, line in enumerate(lines):
+            if i and i <= len(self.series):
+                ctx.set_source_rgb(*parse_color(self.series[i - 1].color))
+            else:
+                ctx.set_source_rgb(*TEXT_COLOR)
+            ctx.move_to(bx + 8, by + 18 * (i + 1))
+            ctx.show_text(line)
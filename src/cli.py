@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Command line interface - 'habits <command>' entry points
+#
+# Only the module needed by the selected command is imported, so none of
+# these pull in GTK.
+
+import argparse
+import sys
+
+
+def cmd_export(args):
+    import exporter
+    output = args.output
+    if output is None:
+        output = '.' if args.format == 'csv' else '-'
+    try:
+        exporter.export(args.format, output, args.tables, args.start_date,
+                        args.end_date, args.db)
+    except FileNotFoundError as e:
+        sys.exit('Cannot export: {}'.format(e))
+
+
+def cmd_import_legacy(args):
+    from migrate_to_sqlite import migrate_json_to_sqlite
+    if args.file:
+        migrate_json_to_sqlite(args.file, args.force)
+    else:
+        migrate_json_to_sqlite(force=args.force)
+
+
+def cmd_backup(args):
+    from backup import Backup, BACKUP_DIR
+    keep = args.keep
+    if keep is None:
+        from configurator import Configuration
+        keep = Configuration().get('preferences').get('backup-keep', 7)
+    backup = Backup(directory=args.dir or BACKUP_DIR, keep=keep)
+    if args.list:
+        for filename in backup.list():
+            print(filename)
+    else:
+        print(backup.run())
+
+
+def cmd_merge(args):
+    from database import Database
+    from merge import merge_databases
+    db = Database(args.into) if args.into else None
+    for source, status in merge_databases(args.sources, db):
+        if status == 'same machine':
+            status = ('skipped, it has the machine ID of the target, so it '
+                      'was probably copied from it (see README to give it '
+                      'a new ID)')
+        print('{}: {}'.format(source, status))
+
+
+def cmd_collector(args):
+    from collector import Collector, DEFAULT_ADDRESS
+    from database import Database
+    db = Database(args.db) if args.db else None
+    Collector(args.listen or DEFAULT_ADDRESS, db).serve_forever()
+
+
+def cmd_report(args):
+    from datetime import date, timedelta
+    import sqlite3
+    from database import DB_FILE
+    import report
+    formats = args.formats or ['png']
+    if set(formats) - {'csv'}:
+        try:
+            import cairo  # noqa: F401
+        except ImportError:
+            sys.exit('PNG and SVG reports need pycairo (python3-cairo)')
+    try:
+        ranges = [report.parse_range(r) for r in args.ranges or []]
+    except ValueError as e:
+        sys.exit(str(e))
+    if args.start_date or args.end_date:
+        ranges.append((args.start_date or report.ALL_TIME[0],
+                       args.end_date or report.ALL_TIME[1]))
+    if not ranges:
+        today = date.today()
+        ranges.append(((today - timedelta(days=13)).isoformat(),
+                       today.isoformat()))
+    try:
+        paths = report.run_reports(args.dbs or [DB_FILE], ranges, formats,
+                                   args.output, args.width, args.height,
+                                   args.jobs)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        sys.exit('Cannot create the reports: {}'.format(e))
+    for path in paths:
+        print(path)
+
+
+def build_parser():
+    from exporter import FORMATS, TABLES
+    parser = argparse.ArgumentParser(
+        prog='habits',
+        description='Habits Monitor command line tools. '
+                    'Run without arguments to start the indicator.')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    export = subparsers.add_parser(
+        'export', help='export tracked data to CSV, JSON Lines or SQL')
+    export.add_argument('-f', '--format', choices=FORMATS, default='csv',
+                        help='output format (default: csv)')
+    export.add_argument('-o', '--output',
+                        help="directory for csv (default: current), "
+                             "file or '-' for jsonl/sql (default: stdout)")
+    export.add_argument('--from', dest='start_date', metavar='YYYY-MM-DD',
+                        help='first day to export')
+    export.add_argument('--to', dest='end_date', metavar='YYYY-MM-DD',
+                        help='last day to export')
+    export.add_argument('-t', '--table', dest='tables', action='append',
+                        choices=list(TABLES),
+                        help='table to export (repeatable, default: all)')
+    export.add_argument('--db', help='database file (default: habits.db)')
+    export.set_defaults(func=cmd_export)
+
+    import_legacy = subparsers.add_parser(
+        'import-legacy', help='import a legacy habits.conf (JSON) file')
+    import_legacy.add_argument('file', nargs='?',
+                               help='file to import (default: habits.conf)')
+    import_legacy.add_argument('--force', action='store_true',
+                               help='import even if already imported')
+    import_legacy.set_defaults(func=cmd_import_legacy)
+
+    backup = subparsers.add_parser(
+        'backup', help='take a compressed snapshot of the database')
+    backup.add_argument('--keep', type=int,
+                        help='snapshots to keep (default: preference '
+                             'backup-keep)')
+    backup.add_argument('--dir', help='snapshot directory')
+    backup.add_argument('--list', action='store_true',
+                        help='list existing snapshots instead')
+    backup.set_defaults(func=cmd_backup)
+
+    merge = subparsers.add_parser(
+        'merge', help='add the data of databases from other machines')
+    merge.add_argument('sources', nargs='+', metavar='SOURCE',
+                       help='habits.db file to merge')
+    merge.add_argument('--into', metavar='DB',
+                       help='target database (default: habits.db)')
+    merge.set_defaults(func=cmd_merge)
+
+    collector = subparsers.add_parser(
+        'collector', help='collect counters pushed by other monitors')
+    collector.add_argument('--listen', metavar='ADDRESS',
+                           help="'unix:/path' or 'tcp:127.0.0.1:PORT' "
+                                "(default: collector.sock in the config "
+                                "directory)")
+    collector.add_argument('--db', help='database file (default: habits.db)')
+    collector.set_defaults(func=cmd_collector)
+
+    report = subparsers.add_parser(
+        'report', help='render charts (PNG/SVG) or CSV for date ranges')
+    report.add_argument('-f', '--format', dest='formats', action='append',
+                        choices=('png', 'svg', 'csv'),
+                        help='output format (repeatable, default: png)')
+    report.add_argument('-o', '--output', default='.',
+                        help='output directory (default: current)')
+    report.add_argument('--from', dest='start_date', metavar='YYYY-MM-DD',
+                        help='first day of a range')
+    report.add_argument('--to', dest='end_date', metavar='YYYY-MM-DD',
+                        help='last day of a range')
+    report.add_argument('-r', '--range', dest='ranges', action='append',
+                        metavar='FROM:TO',
+                        help="date range or 'all' (repeatable, default: "
+                             "last 14 days)")
+    report.add_argument('--db', dest='dbs', action='append',
+                        help='database file (repeatable, default: '
+                             'habits.db)')
+    report.add_argument('--width', type=int, default=900,
+                        help='chart width in pixels (default: 900)')
+    report.add_argument('--height', type=int, default=600,
+                        help='chart height in pixels (default: 600)')
+    report.add_argument('-j', '--jobs', type=int,
+                        help='rendering processes (default: one per CPU)')
+    report.set_defaults(func=cmd_report)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
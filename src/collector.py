@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Collector - Aggregate counter deltas pushed by many monitors
+#
+# Monitors send batches of counter increments (see Database.apply_deltas)
+# over a Unix socket or a localhost TCP port. Each message is a 4-byte
+# big-endian length followed by compact JSON, answered with one ACK byte
+# once the batch is committed. A single writer thread commits everything
+# that has queued up in one transaction, so hundreds of clients cost one
+# write per batch instead of one per client. The IDs of applied messages
+# are stored in the same transaction (see Database.apply_deltas), so a
+# batch resent after a lost ACK or a collector restart is dropped.
+#
+# Addresses are 'unix:/path/to/socket' or 'tcp:127.0.0.1:8765'.
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+import uuid
+from config import CONFIG_DIR
+from database import Database
+
+HEADER = struct.Struct('!I')
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+ACK = b'\x01'
+
+DEFAULT_ADDRESS = 'unix:' + os.path.join(CONFIG_DIR, 'collector.sock')
+SPOOL_FILE = os.path.join(CONFIG_DIR, 'collector.spool')
+
+# Client connection timeout and retry policy
+TIMEOUT = 2.0
+RETRIES = 2
+RETRY_DELAY = 0.2
+
+# Messages committed per writer transaction, at most
+WRITER_BATCH = 500
+
+# Days the IDs of applied messages are kept, and how often (in seconds)
+# older ones are deleted
+APPLIED_DAYS = 30
+PRUNE_SECONDS = 3600
+
+
+def parse_address(address):
+    """Return (socket family, socket address) for an address string"""
+    kind, _, rest = address.partition(':')
+    if kind == 'unix' and rest:
+        return socket.AF_UNIX, rest
+    if kind == 'tcp' and rest:
+        host, _, port = rest.rpartition(':')
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    raise ValueError('Invalid collector address: {}'.format(address))
+
+
+def encode_message(message):
+    payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(len(payload)) + payload
+
+
+def read_exactly(stream, size):
+    """Read size bytes from a file-like object (None at a clean EOF)"""
+    data = stream.read(size)
+    if not data:
+        return None
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise EOFError('Truncated message')
+        data += chunk
+    return data
+
+
+def read_frame(stream):
+    """Read one length-prefixed frame (None at a clean EOF)"""
+    header = read_exactly(stream, HEADER.size)
+    if header is None:
+        return None
+    size, = HEADER.unpack(header)
+    if size > MAX_MESSAGE_SIZE:
+        raise ValueError('Message too large: {} bytes'.format(size))
+    return read_exactly(stream, size)
+
+
+def merge_deltas(target, deltas):
+    """Add the {date: {counter: increment}} deltas into target"""
+    for date, counters in deltas.items():
+        day = target.setdefault(date, {})
+        for counter, value in counters.items():
+            day[counter] = day.get(counter, 0) + value
+    return target
+
+
+class CollectorClient(object):
+    """Push counter deltas to a collector through an on-disk spool
+
+    push() only appends the batch to the spool file, so the caller never
+    waits on the network; a background thread then sends the spool.
+    Delivery is at least once on the wire; every message carries an ID so
+    the collector can drop a batch resent after a lost ACK.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, spool_file=SPOOL_FILE,
+                 machine_id=None):
+        self.family, self.address = parse_address(address)
+        self.spool_file = spool_file
+        self.machine_id = machine_id
+        # Guards the spool file and the sender state
+        self.lock = threading.Lock()
+        # One flush at a time
+        self.send_lock = threading.Lock()
+        self.sender = None
+        self.pending = False
+        # Whether a partial frame left by a crash was cut off the spool
+        self.spool_repaired = False
+
+    def push(self, deltas, keycodes=None):
+        """Spool deltas and send them from a background thread"""
+        frame = encode_message({'id': uuid.uuid4().hex,
+                                'machine': self.machine_id,
+                                'deltas': deltas,
+                                'keycodes': keycodes or {}})
+        with self.lock:
+            self.append_spool(frame)
+            self.pending = True
+            if self.sender is None:
+                self.sender = threading.Thread(target=self.send_loop,
+                                               daemon=True)
+                self.sender.start()
+
+    def send_loop(self):
+        """Flush until no push arrived during the last flush"""
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.sender = None
+                    return
+                self.pending = False
+            self.flush()
+
+    def flush(self):
+        """Send everything spooled, retrying a few times
+
+        Returns:
+            True if the collector acknowledged everything, False if the
+            data stays spooled for the next push
+        """
+        with self.send_lock:
+            with self.lock:
+                frames = self.read_spool()
+            if not frames:
+                return True
+            sent = 0
+            for attempt in range(RETRIES + 1):
+                acked, error = self.send(frames[sent:])
+                sent += acked
+                if error is None:
+                    break
+                if attempt < RETRIES:
+                    time.sleep(RETRY_DELAY * (attempt + 1))
+            # Acknowledged frames are committed, never send them again
+            if sent:
+                self.remove_spooled(sent)
+            if error is None:
+                return True
+            print('Collector unavailable ({}), {} batches spooled'.format(
+                error, len(frames) - sent))
+            return False
+
+    def send(self, frames):
+        """Send frames over one connection, waiting for each ACK
+
+        Returns:
+            Tuple (number of frames acknowledged, error or None)
+        """
+        acked = 0
+        try:
+            with socket.socket(self.family, socket.SOCK_STREAM) as sock:
+                sock.settimeout(TIMEOUT)
+                sock.connect(self.address)
+                for frame in frames:
+                    sock.sendall(frame)
+                    if sock.recv(1) != ACK:
+                        raise EOFError('Collector did not acknowledge')
+                    acked += 1
+        except (OSError, EOFError) as e:
+            return acked, e
+        return acked, None
+
+    def read_spool(self):
+        return self.scan_spool()[0]
+
+    def scan_spool(self):
+        """Complete frames of the spool and the offset where they end"""
+        if not os.path.exists(self.spool_file):
+            return [], 0
+        frames = []
+        end = 0
+        with open(self.spool_file, 'rb') as f:
+            while True:
+                try:
+                    payload = read_frame(f)
+                except (EOFError, ValueError):
+                    # A crash while appending leaves a partial last frame
+                    break
+                if payload is None:
+                    break
+                frames.append(HEADER.pack(len(payload)) + payload)
+                end = f.tell()
+        return frames, end
+
+    def repair_spool(self):
+        """Cut a partial frame off the end of the spool, once per process
+
+        Frames appended after torn bytes would be read as part of the
+        torn frame and lost with it.
+        """
+        if self.spool_repaired:
+            return
+        self.spool_repaired = True
+        end = self.scan_spool()[1]
+        if os.path.exists(self.spool_file) and \
+                os.path.getsize(self.spool_file) > end:
+            print('Dropping a partial batch from the collector spool')
+            with open(self.spool_file, 'r+b') as f:
+                f.truncate(end)
+
+    def append_spool(self, frame):
+        directory = os.path.dirname(self.spool_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, 0o700)
+        self.repair_spool()
+        with open(self.spool_file, 'ab') as f:
+            start = f.tell()
+            try:
+                f.write(frame)
+                f.flush()
+                os.fsync(f.fileno())
+            except OSError:
+                # Do not leave part of the frame behind (disk full...)
+                f.truncate(start)
+                raise
+
+    def remove_spooled(self, count):
+        """Drop the first count frames, keeping those pushed meanwhile
+
+        Only complete frames are written back, so a partial last frame
+        is dropped as well.
+        """
+        with self.lock:
+            remaining = self.read_spool()[count:]
+            if not remaining:
+                if os.path.exists(self.spool_file):
+                    os.remove(self.spool_file)
+                return
+            temporary = self.spool_file + '.tmp'
+            with open(temporary, 'wb') as f:
+                f.write(b''.join(remaining))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.spool_file)
+
+
+class UnixCollectorServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class TCPCollectorServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+class CollectorHandler(socketserver.StreamRequestHandler):
+    """Read frames from one client until it disconnects"""
+
+    def handle(self):
+        while True:
+            try:
+                payload = read_frame(self.rfile)
+            except (EOFError, ValueError, OSError) as e:
+                print('Dropping collector client: {}'.format(e))
+                return
+            if payload is None:
+                return
+            try:
+                message = json.loads(payload.decode('utf-8'))
+                deltas = message['deltas']
+            except (ValueError, KeyError, TypeError) as e:
+                print('Invalid collector message: {}'.format(e))
+                return
+            done = self.server.collector.submit(
+                message.get('id'), deltas, message.get('keycodes'))
+            done.wait()
+            if not done.ok:
+                return
+            self.wfile.write(ACK)
+
+
+class Collector(object):
+    """Receive deltas from many monitors and write them with one writer"""
+
+    def __init__(self, address=DEFAULT_ADDRESS, db=None):
+        self.address = address
+        self.db = db if db is not None else Database()
+        self.queue = queue.Queue()
+        self.pruned_at = 0
+        self.server = None
+        self.writer = None
+        self.running = False
+
+    def submit(self, message_id, deltas, keycodes=None):
+        """Queue deltas for the writer; returns an Event set on commit"""
+        done = threading.Event()
+        done.ok = False
+        self.queue.put((message_id, deltas, keycodes or {}, done))
+        return done
+
+    def write_loop(self):
+        """Commit queued batches; the only thread writing the database"""
+        while self.running or not self.queue.empty():
+            try:
+                items = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(items) < WRITER_BATCH:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self.write(items)
+                ok = True
+            except Exception as e:
+                # Nothing was committed, the clients resend them
+                print('Error writing collected data: {}'.format(e))
+                ok = False
+            for _, _, _, done in items:
+                done.ok = ok
+                done.set()
+
+    def write(self, items):
+        """Apply the queued messages not applied before, in one transaction"""
+        applied = self.db.get_applied_messages(
+            [message_id for message_id, _, _, _ in items
+             if message_id is not None])
+        combined = {}
+        keycodes = {}
+        message_ids = []
+        for message_id, deltas, message_keycodes, _ in items:
+            if message_id is not None:
+                if message_id in applied:
+                    continue
+                applied.add(message_id)
+                message_ids.append(message_id)
+            merge_deltas(combined, deltas)
+            keycodes.update(message_keycodes)
+        if combined or message_ids:
+            self.db.apply_deltas(combined, keycodes, message_ids)
+        if time.time() - self.pruned_at > PRUNE_SECONDS:
+            self.db.forget_applied_messages(
+                time.time() - APPLIED_DAYS * 86400)
+            self.pruned_at = time.time()
+
+    def start(self):
+        """Start listening and writing in background threads"""
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.remove(address)
+            server_class = UnixCollectorServer
+        else:
+            server_class = TCPCollectorServer
+        self.server = server_class(address, CollectorHandler)
+        self.server.collector = self
+        self.running = True
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def stop(self):
+        """Stop accepting clients and commit what is still queued"""
+        self.server.shutdown()
+        self.server.server_close()
+        self.running = False
+        self.writer.join()
+        family, address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+
+    def serve_forever(self):
+        self.start()
+        print('Collector listening on {}'.format(self.address))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+if __name__ == '__main__':
+    Collector().serve_forever()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Load test for the collector: many simulated monitors pushing deltas
+#
+# Starts a collector on a temporary socket and database, lets every
+# client push its batches concurrently, then checks that the stored
+# totals match exactly what was sent.
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from collector import Collector, CollectorClient
+from database import Database
+
+
+def run_client(address, spool_file, batches, sent, lock, seed):
+    rng = random.Random(seed)
+    client = CollectorClient(address, spool_file, 'client-{}'.format(seed))
+    totals = {'distance': 0, 'clics': 0, 'keys': 0}
+    for _ in range(batches):
+        deltas = {'2025-01-01': {
+            'distance': rng.randint(0, 5000),
+            'clics': rng.randint(0, 50),
+            'keys': rng.randint(0, 500),
+            'Button-{}'.format(rng.choice((1, 2, 3))): rng.randint(1, 20),
+            'Key-{}'.format(rng.choice('abcdefgh')): rng.randint(1, 40),
+            'Code-{}'.format(rng.randint(38, 45)): rng.randint(1, 40),
+        }}
+        client.push(deltas, {38 + i: c for i, c in enumerate('asdfghjk')})
+        if not client.flush():
+            raise RuntimeError('Client {} had to spool'.format(seed))
+        for key in totals:
+            totals[key] += deltas['2025-01-01'][key]
+    with lock:
+        for key in totals:
+            sent[key] += totals[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clients', type=int, default=300)
+    parser.add_argument('--batches', type=int, default=20)
+    parser.add_argument('--tcp', action='store_true',
+                        help='use localhost TCP instead of a Unix socket')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.tcp:
+            address = 'tcp:127.0.0.1:{}'.format(random.randint(20000, 60000))
+        else:
+            address = 'unix:' + os.path.join(directory, 'collector.sock')
+        db = Database(os.path.join(directory, 'collector.db'))
+        collector = Collector(address, db)
+        collector.start()
+
+        sent = {'distance': 0, 'clics': 0, 'keys': 0}
+        lock = threading.Lock()
+        threads = [threading.Thread(target=run_client, args=(
+            address, os.path.join(directory, 'spool-{}'.format(i)),
+            args.batches, sent, lock, i)) for i in range(args.clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        collector.stop()
+
+        stored = db.get_daily_stat('2025-01-01')
+        messages = args.clients * args.batches
+        print('{} clients, {} messages in {:.2f}s ({:.0f} messages/s)'.format(
+            args.clients, messages, elapsed, messages / elapsed))
+        print('sent:   {}'.format(sent))
+        print('stored: distance={distance} clics={clics} keys={keys}'.format(
+            **stored))
+        if any(stored[key] != sent[key] for key in sent):
+            raise SystemExit('Stored totals do not match what was sent')
+        print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -25,8 +25,7 @@
 
 import sys
 import os
-import locale
-import gettext
+import functools
 
 PARAMS = {'stats': {},
           'preferences': {'theme-light': True,
@@ -34,7 +33,23 @@ PARAMS = {'stats': {},
                           'distance-color': '#445c3c',
                           'clics-color': '#bd574e',
                           'keys-color': '#142d4c',
-                          'units': 'meters'}
+                          'units': 'meters',
+                          'retention-daily-stats': 0,
+                          'retention-mouse-buttons': 0,
+                          'retention-keyboard-daily': 0,
+                          'downsample-mouse-buttons': 0,
+                          'maintenance-idle-minutes': 5,
+                          'maintenance-interval-hours': 24,
+                          'backup-keep': 7,
+                          'collector-address': '',
+                          'collector-only': False,
+                          'storage-mode': 'disk',
+                          'checkpoint-minutes': 15,
+                          'prewarm-statistics': False,
+                          'chart-renderer': 'webkit',
+                          'live-counters': 'off',
+                          'live-counters-seconds': 10,
+                          'save-minutes': 5}
           }
 
 CONFIG_DIR = os.path.join(os.path.expanduser('~'), '.config/habits')
@@ -46,7 +61,8 @@ def is_package():
 
 
 APP = 'habits'
-APPNAME = 'Habits'
+# Translated on access, as config.APPNAME
+APP_NAME = 'Habits'
 
 # check if running from source
 if is_package():
@@ -74,25 +90,48 @@ ICON_PAUSED_LIGHT = os.path.join(ICONDIR, 'habits-paused.svg')
 ICON_ACTIVED_DARK = os.path.join(ICONDIR, 'habits-active-dark.svg')
 ICON_PAUSED_DARK = os.path.join(ICONDIR, 'habits-paused-dark.svg')
 
-f = open(CHANGELOG, 'r')
-line = f.readline()
-f.close()
-pos = line.find('(')
-posf = line.find(')', pos)
-VERSION = line[pos + 1:posf].strip()
-if not is_package():
-    VERSION = VERSION + '-src'
-
-try:
-    current_locale, encoding = locale.getdefaultlocale()
-    language = gettext.translation(APP, LANGDIR, [current_locale])
-    language.install()
-    print(language)
-    if sys.version_info[0] == 3:
-        _ = language.gettext
-    else:
-        _ = language.ugettext
-except Exception as e:
-    print(e)
-    _ = str
-APPNAME = _(APPNAME)
+
+# VERSION, APPNAME and the translations are resolved on first use, so
+# importing this module reads no file and modules that only need the
+# paths (the monitor, the collector, the command line tools) start fast.
+
+
+@functools.lru_cache(maxsize=None)
+def get_version():
+    with open(CHANGELOG, 'r') as f:
+        line = f.readline()
+    pos = line.find('(')
+    posf = line.find(')', pos)
+    version = line[pos + 1:posf].strip()
+    if not is_package():
+        version = version + '-src'
+    return version
+
+
+@functools.lru_cache(maxsize=None)
+def get_translation():
+    """The gettext function for the current locale, str if there is none"""
+    import locale
+    import gettext
+    try:
+        current_locale, encoding = locale.getdefaultlocale()
+        language = gettext.translation(APP, LANGDIR, [current_locale])
+        language.install()
+        return language.gettext
+    except Exception as e:
+        # stderr, so 'habits export' can write to stdout
+        print(e, file=sys.stderr)
+        return str
+
+
+def _(message):
+    return get_translation()(message)
+
+
+def __getattr__(name):
+    if name == 'VERSION':
+        return get_version()
+    if name == 'APPNAME':
+        return _(APP_NAME)
+    raise AttributeError(
+        "module '{}' has no attribute '{}'".format(__name__, name))
@@ -6,6 +6,7 @@
 
 import os
 import json
+from datetime import datetime, timedelta
 from database import Database
 from config import CONFIG_DIR, PARAMS
 
@@ -110,6 +111,28 @@ class Configuration(object):
                 value_str = str(value)
                 self.db.save_preference(key, value_str)
 
+    def get_stats_date_range(self):
+        """Date range chosen in Preferences for the statistics
+
+        Returns:
+            Tuple (start_date, end_date) as 'YYYY-MM-DD', or (None, None)
+            for all time
+        """
+        preferences = self.get('preferences')
+        date_range_days = preferences.get('stats-date-range', 14)
+        today = datetime.now().date()
+        if date_range_days == -1:
+            return None, None
+        if date_range_days == 0:
+            start_date = preferences.get(
+                'stats-custom-start',
+                (today - timedelta(days=13)).strftime('%Y-%m-%d'))
+            end_date = preferences.get('stats-custom-end',
+                                       today.strftime('%Y-%m-%d'))
+            return start_date, end_date
+        start_date = today - timedelta(days=date_range_days - 1)
+        return start_date.strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d')
+
     def __str__(self):
         """String representation"""
         ans = ''
@@ -3,27 +3,258 @@
 
 import sqlite3
 import os
+import sys
+import time
+import operator
+from array import array
+import functools
+import threading
+from collections import OrderedDict
+from urllib.request import pathname2url
 from config import CONFIG_DIR
 
 # Database file location
 DB_FILE = os.path.join(CONFIG_DIR, 'habits.db')
 
+# Maximum number of cached query results
+CACHE_SIZE = 64
+
+# Databases served from memory (see ramstore.py), as {db_file: uri}
+memory_databases = {}
+
+# Slots in a keyboard_daily counts BLOB, one per X keycode
+KEYCODES = 256
+
+# Tables whose writes are counted in table_generations (see QueryCache)
+GENERATION_TABLES = ('daily_stats', 'preferences', 'mouse_buttons',
+                     'mouse_buttons_monthly', 'keyboard_keys',
+                     'keyboard_daily', 'keycodes')
+
+# Internal state that earlier versions kept in preferences, now in metadata
+STATE_KEYS = ('maintenance-last-run', 'legacy-import')
+
+# Date column of the GENERATION_TABLES holding one row per day or month
+GENERATION_DATES = {
+    'daily_stats': 'date',
+    'mouse_buttons': 'date',
+    'mouse_buttons_monthly': 'month',
+    'keyboard_daily': 'date',
+}
+
+
+class QueryCache(object):
+    """LRU cache for Database read methods
+
+    Each entry remembers the write generation of the tables it was read
+    from. Triggers bump a table's row in table_generations on every write,
+    from this process or any other (merge, imports, maintenance), and a
+    long-lived connection per database re-reads those rows only when
+    PRAGMA data_version says something was committed.
+
+    Dated tables also keep the latest date ever written and a second
+    counter, old_generation, bumped only by writes to earlier dates. The
+    tracker only writes to today, so a result for a range ending before
+    the latest date stays valid as long as old_generation is unchanged.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        # db_file -> [connection, memory uri, data_version,
+        #             {table: (generation, old_generation, latest_date)}]
+        self.watches = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def generation(self, db, tables):
+        """Current (generation, old_generation, latest_date) of tables in
+        the database of db"""
+        with self.lock:
+            uri = memory_databases.get(os.path.abspath(db.db_file))
+            watch = self.watches.get(db.db_file)
+            if watch is None or watch[1] != uri:
+                if watch is not None:
+                    watch[0].close()
+                watch = [db.open(check_same_thread=False), uri, None, {}]
+                self.watches[db.db_file] = watch
+            conn = watch[0]
+            version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if version != watch[2]:
+                watch[2] = version
+                watch[3] = {row[0]: row[1:] for row in conn.execute('''
+                    SELECT name, generation, old_generation, latest_date
+                    FROM table_generations
+                ''')}
+            return tuple(watch[3].get(table, (0, 0, None))
+                         for table in tables)
+
+    def get(self, key, generation, end_date=None):
+        """Return (True, value) on a hit and (False, None) on a miss
+
+        end_date, the last date the result depends on, lets it survive
+        writes to later dates.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry_generation, value = entry
+                if all(is_current(cached, current, end_date)
+                       for cached, current in zip(entry_generation,
+                                                  generation)):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, generation, value):
+        with self.lock:
+            self.entries[key] = (generation, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self, db_file=None):
+        """Drop cached results (for one database file, or all of them)"""
+        with self.lock:
+            if db_file is None:
+                self.entries.clear()
+            else:
+                for key in [k for k in self.entries if k[0] == db_file]:
+                    del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self.entries)}
+
+
+def is_current(cached, current, end_date):
+    """Whether no write since cached touched a date up to end_date"""
+    if cached == current:
+        return True
+    latest_date = cached[2]
+    return end_date is not None and latest_date is not None and \
+        end_date < latest_date and cached[1] == current[1]
+
+
+query_cache = QueryCache()
+
+# Key name -> key_names id, per database file (see Database.get_key_ids)
+interned_keys = {}
+
+
+def copy_result(value):
+    """Copy a cached result so callers can modify what they get back"""
+    if isinstance(value, dict):
+        return {k: dict(v) if isinstance(v, dict) else v
+                for k, v in value.items()}
+    return value
+
+
+def unpack_counts(blob):
+    """Decode a keyboard_daily BLOB into KEYCODES integers"""
+    counts = array('I')
+    counts.frombytes(blob)
+    if sys.byteorder == 'big':
+        counts.byteswap()
+    if len(counts) < KEYCODES:
+        counts.extend([0] * (KEYCODES - len(counts)))
+    return counts
+
+
+def pack_counts(counts):
+    """Encode keycode counts as little-endian uint32, without trailing zeros
+
+    Most keyboards only use keycodes below ~140, so trimming the unused
+    tail keeps a day at roughly half of the full 1 KiB.
+    """
+    counts = array('I', counts)
+    end = len(counts)
+    while end and not counts[end - 1]:
+        end -= 1
+    counts = counts[:end]
+    if sys.byteorder == 'big':
+        counts.byteswap()
+    return counts.tobytes()
+
+
+def add_counts(blob, other):
+    """SQL function adding two keyboard_daily BLOBs slot by slot"""
+    if blob is None:
+        return other
+    if other is None:
+        return blob
+    return pack_counts(map(operator.add, unpack_counts(blob),
+                           unpack_counts(other)))
+
+
+def connect_read_only(db_file):
+    """Open a database without creating or changing it"""
+    uri = memory_databases.get(os.path.abspath(db_file))
+    if uri is None:
+        if not os.path.exists(db_file):
+            raise FileNotFoundError('No such database: {}'.format(db_file))
+        uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(db_file)))
+    conn = sqlite3.connect(uri, uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def cached(*tables, end_date=None):
+    """Cache a Database read method in query_cache
+
+    Args:
+        tables: Tables the method reads from, all listed in
+            GENERATION_TABLES
+        end_date: Position of the argument holding the last date the
+            method reads, if it reads up to a date; the result is then
+            kept while only later dates are written
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (self.db_file, method.__name__, args,
+                   tuple(sorted(kwargs.items())))
+            generation = query_cache.generation(self, tables)
+            last = args[end_date] if end_date is not None and \
+                len(args) > end_date else None
+            found, value = query_cache.get(key, generation, last)
+            if not found:
+                value = method(self, *args, **kwargs)
+                query_cache.put(key, generation, value)
+            return copy_result(value)
+        return wrapper
+    return decorator
+
 
 class Database:
     """Handle SQLite database operations for habits tracking"""
 
-    def __init__(self):
-        self.db_file = DB_FILE
+    def __init__(self, db_file=None):
+        self.db_file = db_file if db_file is not None else DB_FILE
         self.connection = None
         self.create_tables()
 
+    def open(self, **kwargs):
+        """Plain sqlite3 connection, to the memory copy if there is one"""
+        uri = memory_databases.get(os.path.abspath(self.db_file))
+        if uri is not None:
+            return sqlite3.connect(uri, uri=True, **kwargs)
+        return sqlite3.connect(self.db_file, **kwargs)
+
     def connect(self):
         """Connect to the SQLite database"""
-        if not os.path.exists(CONFIG_DIR):
-            os.makedirs(CONFIG_DIR, 0o700)
+        db_dir = os.path.dirname(os.path.abspath(self.db_file))
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir, 0o700)
 
-        self.connection = sqlite3.connect(self.db_file)
+        self.connection = self.open()
         self.connection.row_factory = sqlite3.Row  # Access columns by name
+        self.connection.create_function('add_counts', 2, add_counts,
+                                        deterministic=True)
         return self.connection
 
     def create_tables(self):
@@ -31,6 +262,10 @@ class Database:
         conn = self.connect()
         cursor = conn.cursor()
 
+        # Only takes effect on a brand new database; existing files are
+        # converted once by the idle-time maintenance (see maintenance.py)
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
         # Table for daily statistics
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS daily_stats (
@@ -66,20 +301,407 @@ class Database:
             )
         ''')
 
+        # Mouse button counts of old months, folded from mouse_buttons by
+        # the maintenance; month is the first day, 'YYYY-MM-01'
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS mouse_buttons_monthly (
+                month TEXT NOT NULL,
+                button INTEGER NOT NULL,
+                count INTEGER DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (month, button)
+            ) WITHOUT ROWID
+        ''')
+
+        # Dictionary of key names; the count tables refer to keys by id
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS key_names (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL
+            )
+        ''')
+
         # Table for individual keyboard key tracking (total counts, not per-day)
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS keyboard_keys (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                key_name TEXT UNIQUE NOT NULL,
+                key_id INTEGER PRIMARY KEY REFERENCES key_names(id),
                 count INTEGER DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
 
+        # Per-day keyboard counts: one BLOB of little-endian uint32
+        # counters per day, indexed by X keycode (see pack_counts)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS keyboard_daily (
+                date TEXT PRIMARY KEY,
+                counts BLOB NOT NULL
+            ) WITHOUT ROWID
+        ''')
+
+        # Key each keycode produced when it was last pressed
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS keycodes (
+                keycode INTEGER PRIMARY KEY,
+                key_id INTEGER NOT NULL REFERENCES key_names(id)
+            )
+        ''')
+
+        # Table for database-level settings (not user preferences)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
+
+        # Random ID identifying the machine this database belongs to
+        cursor.execute('''
+            INSERT OR IGNORE INTO metadata (key, value)
+            VALUES ('machine-id', lower(hex(randomblob(16))))
+        ''')
+
+        # Move internal state out of the user preferences
+        placeholders = ', '.join('?' * len(STATE_KEYS))
+        cursor.execute('''
+            INSERT OR IGNORE INTO metadata (key, value)
+            SELECT key, value FROM preferences WHERE key IN ({})
+        '''.format(placeholders), STATE_KEYS)
+        cursor.execute('''
+            DELETE FROM preferences WHERE key IN ({})
+        '''.format(placeholders), STATE_KEYS)
+
+        # Databases from other machines already merged into this one
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS merged_sources (
+                machine_id TEXT PRIMARY KEY,
+                source TEXT,
+                merged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        self.create_merge_snapshots(cursor)
+
+        # IDs of the collector messages already applied (see collector.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS applied_messages (
+                id TEXT PRIMARY KEY,
+                applied_at INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS applied_messages_applied_at
+            ON applied_messages (applied_at)
+        ''')
+
+        self.create_totals(cursor)
+
+        conn.commit()
+
+        cursor.execute('PRAGMA table_info(keyboard_keys)')
+        if 'key_name' in [row['name'] for row in cursor.fetchall()]:
+            self.intern_keyboard_keys(conn)
+
+        # After the table rebuild above, which drops its triggers
+        self.create_generations(cursor)
         conn.commit()
+
         conn.close()
 
+    def create_generations(self, cursor):
+        """Write counters of the cached tables, bumped by triggers
+
+        Every insert, update or delete, whichever process or connection
+        makes it, increments the row of its table, so QueryCache can tell
+        which cached results are stale. For the GENERATION_DATES tables,
+        the latest date written is kept too, and writes to earlier dates
+        also increment old_generation.
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS table_generations (
+                name TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL DEFAULT 0,
+                old_generation INTEGER NOT NULL DEFAULT 0,
+                latest_date TEXT
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('PRAGMA table_info(table_generations)')
+        if 'latest_date' not in [row['name'] for row in cursor.fetchall()]:
+            cursor.execute('''
+                ALTER TABLE table_generations
+                ADD COLUMN old_generation INTEGER NOT NULL DEFAULT 0
+            ''')
+            cursor.execute(
+                'ALTER TABLE table_generations ADD COLUMN latest_date TEXT')
+            for table, column in GENERATION_DATES.items():
+                cursor.execute('''
+                    UPDATE table_generations
+                    SET latest_date = (SELECT MAX({1}) FROM {0})
+                    WHERE name = '{0}'
+                '''.format(table, column))
+        for table in GENERATION_TABLES:
+            cursor.execute('''
+                INSERT INTO table_generations (name, latest_date)
+                SELECT ?, {}
+                WHERE true
+                ON CONFLICT(name) DO NOTHING
+            '''.format('(SELECT MAX({}) FROM {})'.format(
+                GENERATION_DATES[table], table)
+                if table in GENERATION_DATES else 'NULL'), (table,))
+            column = GENERATION_DATES.get(table)
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                row = 'OLD' if event == 'DELETE' else 'NEW'
+                # Replaced by the date-aware triggers below
+                cursor.execute('DROP TRIGGER IF EXISTS {}_generation_{}'
+                               .format(table, event.lower()))
+                if column is None:
+                    updates = 'generation = generation + 1'
+                else:
+                    updates = '''
+                        generation = generation + 1,
+                        old_generation = old_generation +
+                            COALESCE({0}.{1} < latest_date, 0),
+                        latest_date = MAX(COALESCE(latest_date, {0}.{1}),
+                                          {0}.{1})
+                    '''.format(row, column)
+                cursor.execute('''
+                    CREATE TRIGGER IF NOT EXISTS {0}_written_{1}
+                    AFTER {2} ON {0}
+                    BEGIN
+                        UPDATE table_generations
+                        SET {3}
+                        WHERE name = '{0}';
+                    END
+                '''.format(table, event.lower(), event, updates))
+
+    def create_merge_snapshots(self, cursor):
+        """What each merged machine had when it was last merged
+
+        merge.py adds only the difference between a source and its
+        snapshot, so the same machine can be merged again and again.
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS merged_daily_stats (
+                machine_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                distance INTEGER NOT NULL,
+                clicks INTEGER NOT NULL,
+                keys INTEGER NOT NULL,
+                PRIMARY KEY (machine_id, date)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS merged_mouse_buttons (
+                machine_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                button INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (machine_id, date, button)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS merged_mouse_buttons_monthly (
+                machine_id TEXT NOT NULL,
+                month TEXT NOT NULL,
+                button INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (machine_id, month, button)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS merged_keyboard_keys (
+                machine_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (machine_id, name)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS merged_keyboard_daily (
+                machine_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                counts BLOB NOT NULL,
+                PRIMARY KEY (machine_id, date)
+            ) WITHOUT ROWID
+        ''')
+
+    def create_totals(self, cursor):
+        """All-time totals of daily_stats, kept up to date by triggers
+
+        Every write to daily_stats (flushes, merges, imports, retention)
+        adjusts the single stats_totals row, so reading the totals never
+        scans the history.
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_totals (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                distance INTEGER NOT NULL DEFAULT 0,
+                clicks INTEGER NOT NULL DEFAULT 0,
+                keys INTEGER NOT NULL DEFAULT 0,
+                days INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS stats_totals_insert
+            AFTER INSERT ON daily_stats
+            BEGIN
+                UPDATE stats_totals SET
+                    distance = distance + COALESCE(NEW.distance, 0),
+                    clicks = clicks + COALESCE(NEW.clicks, 0),
+                    keys = keys + COALESCE(NEW.keys, 0),
+                    days = days + 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS stats_totals_update
+            AFTER UPDATE OF distance, clicks, keys ON daily_stats
+            BEGIN
+                UPDATE stats_totals SET
+                    distance = distance + COALESCE(NEW.distance, 0)
+                        - COALESCE(OLD.distance, 0),
+                    clicks = clicks + COALESCE(NEW.clicks, 0)
+                        - COALESCE(OLD.clicks, 0),
+                    keys = keys + COALESCE(NEW.keys, 0)
+                        - COALESCE(OLD.keys, 0);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS stats_totals_delete
+            AFTER DELETE ON daily_stats
+            BEGIN
+                UPDATE stats_totals SET
+                    distance = distance - COALESCE(OLD.distance, 0),
+                    clicks = clicks - COALESCE(OLD.clicks, 0),
+                    keys = keys - COALESCE(OLD.keys, 0),
+                    days = days - 1;
+            END
+        ''')
+        # Seed the row once from the existing history
+        cursor.execute('SELECT 1 FROM stats_totals')
+        if cursor.fetchone() is None:
+            cursor.execute('''
+                INSERT INTO stats_totals (id, distance, clicks, keys, days)
+                SELECT 1, COALESCE(SUM(distance), 0), COALESCE(SUM(clicks), 0),
+                       COALESCE(SUM(keys), 0), COUNT(*)
+                FROM daily_stats
+            ''')
+
+    def intern_keyboard_keys(self, conn):
+        """Migrate keyboard_keys from key_name strings to key_names ids"""
+        conn.isolation_level = None
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('''
+                INSERT OR IGNORE INTO key_names (name)
+                SELECT key_name FROM keyboard_keys ORDER BY key_name
+            ''')
+            conn.execute('''
+                CREATE TABLE keyboard_keys_interned (
+                    key_id INTEGER PRIMARY KEY REFERENCES key_names(id),
+                    count INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('''
+                INSERT INTO keyboard_keys_interned
+                    (key_id, count, created_at, updated_at)
+                SELECT key_names.id, keyboard_keys.count,
+                       keyboard_keys.created_at, keyboard_keys.updated_at
+                FROM keyboard_keys
+                JOIN key_names ON key_names.name = keyboard_keys.key_name
+            ''')
+            conn.execute('DROP TABLE keyboard_keys')
+            conn.execute('''
+                ALTER TABLE keyboard_keys_interned RENAME TO keyboard_keys
+            ''')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.isolation_level = ''
+
+    def seed_key_names(self, names):
+        """Add the X keysym names to key_names once per database"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT value FROM metadata WHERE key = 'key-names-seeded'
+        ''')
+        if cursor.fetchone() is None:
+            cursor.executemany('''
+                INSERT OR IGNORE INTO key_names (name) VALUES (?)
+            ''', ((name,) for name in names))
+            cursor.execute('''
+                INSERT INTO metadata (key, value)
+                VALUES ('key-names-seeded', '1')
+            ''')
+            conn.commit()
+
+        conn.close()
+
+    def get_key_ids(self, conn, names):
+        """Map key names to key_names ids, adding unknown names
+
+        The mapping is kept in memory per database file, so the count
+        tables are updated by integer key without string lookups. Names
+        added here only exist in conn's transaction: pass the result to
+        remember_key_ids() once it is committed, so a rollback cannot
+        leave ids in memory that key_names does not have.
+        """
+        key_ids = interned_keys.get(self.db_file, {})
+        missing = [name for name in names if name not in key_ids]
+        if missing:
+            conn.executemany('''
+                INSERT OR IGNORE INTO key_names (name) VALUES (?)
+            ''', ((name,) for name in missing))
+            key_ids = {row['name']: row['id'] for row in
+                       conn.execute('SELECT id, name FROM key_names')}
+        return key_ids
+
+    def remember_key_ids(self, key_ids):
+        """Keep a committed get_key_ids() result for the next writes"""
+        interned_keys[self.db_file] = key_ids
+
+    def get_machine_id(self):
+        """Get the ID of the machine this database belongs to"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT value FROM metadata WHERE key = 'machine-id'
+        ''')
+
+        row = cursor.fetchone()
+        conn.close()
+
+        return row['value']
+
+    def get_metadata(self, key, default=None):
+        """Get a database-level value (not a user preference)"""
+        conn = self.connect()
+        row = conn.execute('SELECT value FROM metadata WHERE key = ?',
+                           (key,)).fetchone()
+        conn.close()
+        return row['value'] if row is not None else default
+
+    def save_metadata(self, key, value):
+        """Save a database-level value (not a user preference)"""
+        conn = self.connect()
+        conn.execute('''
+            INSERT INTO metadata (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        ''', (key, value))
+        conn.commit()
+        conn.close()
+
+    def invalidate_cache(self):
+        """Forget the cached results of this database"""
+        query_cache.clear(self.db_file)
+
     def save_daily_stat(self, date, distance=0, clicks=0, keys=0):
         """Save or update daily statistics"""
         conn = self.connect()
@@ -98,6 +720,7 @@ class Database:
         conn.commit()
         conn.close()
 
+    @cached('daily_stats', end_date=0)
     def get_daily_stat(self, date):
         """Get statistics for a specific date"""
         conn = self.connect()
@@ -121,6 +744,7 @@ class Database:
             }
         return None
 
+    @cached('daily_stats')
     def get_all_stats(self):
         """Get all statistics organized by date"""
         conn = self.connect()
@@ -145,6 +769,26 @@ class Database:
 
         return stats
 
+    @cached('daily_stats')
+    def get_totals(self):
+        """All-time totals from the stats_totals row
+
+        Returns:
+            Dictionary with 'distance', 'clics', 'keys' and 'days'
+        """
+        conn = self.connect()
+        row = conn.execute('''
+            SELECT distance, clicks, keys, days FROM stats_totals
+        ''').fetchone()
+        conn.close()
+        return {
+            'distance': row['distance'],
+            'clics': row['clicks'],
+            'keys': row['keys'],
+            'days': row['days']
+        }
+
+    @cached('daily_stats', end_date=1)
     def get_stats_by_date_range(self, start_date, end_date):
         """Get statistics within a date range (inclusive)
 
@@ -192,6 +836,7 @@ class Database:
         conn.commit()
         conn.close()
 
+    @cached('preferences')
     def get_preference(self, key, default=None):
         """Get a preference value"""
         conn = self.connect()
@@ -208,6 +853,7 @@ class Database:
             return row['value']
         return default
 
+    @cached('preferences')
     def get_all_preferences(self):
         """Get all preferences as a dictionary"""
         conn = self.connect()
@@ -239,6 +885,7 @@ class Database:
         conn.commit()
         conn.close()
 
+    @cached('mouse_buttons', end_date=0)
     def get_mouse_buttons(self, date):
         """Get all mouse button counts for a specific date (excluding scroll buttons)"""
         conn = self.connect()
@@ -260,6 +907,7 @@ class Database:
 
         return buttons
 
+    @cached('mouse_buttons')
     def get_all_mouse_buttons(self):
         """Get all mouse button statistics across all dates (excluding scroll buttons)"""
         conn = self.connect()
@@ -284,6 +932,28 @@ class Database:
 
         return result
 
+    @cached('mouse_buttons_monthly')
+    def get_monthly_mouse_buttons(self):
+        """Mouse button counts of the months folded by the maintenance
+
+        Returns:
+            Dictionary {'YYYY-MM-01': {button: count}}
+        """
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT month, button, count
+            FROM mouse_buttons_monthly
+            WHERE button NOT IN (4, 5)
+            ORDER BY month DESC, button
+        ''').fetchall()
+        conn.close()
+
+        result = {}
+        for row in rows:
+            result.setdefault(row['month'], {})[row['button']] = row['count']
+        return result
+
+    @cached('mouse_buttons', 'mouse_buttons_monthly')
     def get_total_mouse_buttons(self):
         """Get total counts for each mouse button across all dates (excluding scroll buttons)"""
         conn = self.connect()
@@ -291,7 +961,9 @@ class Database:
 
         cursor.execute('''
             SELECT button, SUM(count) as total
-            FROM mouse_buttons
+            FROM (SELECT button, count FROM mouse_buttons
+                  UNION ALL
+                  SELECT button, count FROM mouse_buttons_monthly)
             WHERE button NOT IN (4, 5)
             GROUP BY button
             ORDER BY button
@@ -311,26 +983,30 @@ class Database:
         conn = self.connect()
         cursor = conn.cursor()
 
+        key_ids = self.get_key_ids(conn, [key_name])
         cursor.execute('''
-            INSERT INTO keyboard_keys (key_name, count)
+            INSERT INTO keyboard_keys (key_id, count)
             VALUES (?, ?)
-            ON CONFLICT(key_name) DO UPDATE SET
+            ON CONFLICT(key_id) DO UPDATE SET
                 count = count + ?,
                 updated_at = CURRENT_TIMESTAMP
-        ''', (key_name, count, count))
+        ''', (key_ids[key_name], count, count))
 
         conn.commit()
         conn.close()
+        self.remember_key_ids(key_ids)
 
+    @cached('keyboard_keys')
     def get_keyboard_keys(self):
         """Get all keyboard key counts (total counts, not per-day)"""
         conn = self.connect()
         cursor = conn.cursor()
 
         cursor.execute('''
-            SELECT key_name, count
+            SELECT key_names.name, keyboard_keys.count
             FROM keyboard_keys
-            ORDER BY count DESC
+            JOIN key_names ON key_names.id = keyboard_keys.key_id
+            ORDER BY keyboard_keys.count DESC
         ''')
 
         rows = cursor.fetchall()
@@ -338,7 +1014,7 @@ class Database:
 
         keys = {}
         for row in rows:
-            keys[row['key_name']] = row['count']
+            keys[row['name']] = row['count']
 
         return keys
 
@@ -352,6 +1028,176 @@ class Database:
         # Since we now store totals directly, just return them
         return self.get_keyboard_keys()
 
+    def apply_deltas(self, deltas, keycodes=None, message_ids=()):
+        """Add counter increments to every table in one transaction
+
+        Args:
+            deltas: Dictionary {date: {counter: increment}} using the
+                Monitor counter names: 'distance', 'clics', 'keys',
+                'Button-<number>', 'Key-<key name>' and 'Code-<keycode>'
+            keycodes: Optional dictionary {keycode: key name} used to
+                label the per-day keycode counts
+            message_ids: IDs of the collector messages the deltas come
+                from, recorded in the same transaction
+        """
+        stats = []
+        buttons = []
+        keys = {}
+        codes = []
+        for date, counters in deltas.items():
+            stats.append((date, counters.get('distance', 0),
+                          counters.get('clics', 0), counters.get('keys', 0)))
+            day_codes = None
+            for counter, value in counters.items():
+                if counter.startswith('Button-'):
+                    buttons.append((date, int(counter.split('-')[1]), value))
+                elif counter.startswith('Key-'):
+                    key_name = counter.split('-', 1)[1]
+                    keys[key_name] = keys.get(key_name, 0) + value
+                elif counter.startswith('Code-'):
+                    keycode = int(counter.split('-')[1])
+                    if 0 <= keycode < KEYCODES:
+                        if day_codes is None:
+                            day_codes = [0] * KEYCODES
+                        day_codes[keycode] += value
+            if day_codes is not None:
+                codes.append((date, pack_counts(day_codes)))
+
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.executemany('''
+            INSERT INTO daily_stats (date, distance, clicks, keys)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(date) DO UPDATE SET
+                distance = distance + excluded.distance,
+                clicks = clicks + excluded.clicks,
+                keys = keys + excluded.keys,
+                updated_at = CURRENT_TIMESTAMP
+        ''', stats)
+
+        cursor.executemany('''
+            INSERT INTO mouse_buttons (date, button, count)
+            VALUES (?, ?, ?)
+            ON CONFLICT(date, button) DO UPDATE SET
+                count = count + excluded.count,
+                updated_at = CURRENT_TIMESTAMP
+        ''', buttons)
+
+        key_ids = self.get_key_ids(
+            conn, set(keys).union(keycodes.values() if keycodes else ()))
+        cursor.executemany('''
+            INSERT INTO keyboard_keys (key_id, count)
+            VALUES (?, ?)
+            ON CONFLICT(key_id) DO UPDATE SET
+                count = count + excluded.count,
+                updated_at = CURRENT_TIMESTAMP
+        ''', ((key_ids[name], count) for name, count in keys.items()))
+
+        cursor.executemany('''
+            INSERT INTO keyboard_daily (date, counts)
+            VALUES (?, ?)
+            ON CONFLICT(date) DO UPDATE SET
+                counts = add_counts(counts, excluded.counts)
+        ''', codes)
+
+        if keycodes:
+            self.save_keycodes(conn, keycodes, key_ids)
+
+        now = int(time.time())
+        cursor.executemany('''
+            INSERT OR IGNORE INTO applied_messages (id, applied_at)
+            VALUES (?, ?)
+        ''', ((message_id, now) for message_id in message_ids))
+
+        conn.commit()
+        conn.close()
+        self.remember_key_ids(key_ids)
+
+    def get_applied_messages(self, message_ids):
+        """The IDs in message_ids already applied, as a set"""
+        applied = set()
+        conn = self.connect()
+        # Stay below SQLite's limit on query parameters
+        for i in range(0, len(message_ids), 500):
+            chunk = message_ids[i:i + 500]
+            applied.update(row['id'] for row in conn.execute('''
+                SELECT id FROM applied_messages WHERE id IN ({})
+            '''.format(', '.join('?' * len(chunk))), chunk))
+        conn.close()
+        return applied
+
+    def forget_applied_messages(self, before):
+        """Delete the IDs of messages applied before a Unix time"""
+        conn = self.connect()
+        conn.execute('DELETE FROM applied_messages WHERE applied_at < ?',
+                     (int(before),))
+        conn.commit()
+        conn.close()
+
+    def save_keycodes(self, conn, keycodes, key_ids):
+        """Record which key each keycode produces
+
+        key_ids must map every name in keycodes (see get_key_ids).
+        """
+        conn.executemany('''
+            INSERT INTO keycodes (keycode, key_id)
+            VALUES (?, ?)
+            ON CONFLICT(keycode) DO UPDATE SET key_id = excluded.key_id
+            WHERE key_id != excluded.key_id
+        ''', ((int(keycode), key_ids[name])
+              for keycode, name in keycodes.items()))
+
+    @cached('keyboard_daily', 'keycodes', end_date=1)
+    def get_keyboard_keys_by_date_range(self, start_date, end_date):
+        """Get keyboard key counts within a date range (inclusive)
+
+        Args:
+            start_date: Start date in format 'YYYY-MM-DD'
+            end_date: End date in format 'YYYY-MM-DD'
+
+        Returns:
+            Dictionary {key name: count}, sorted by count (descending)
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        # Days padded to the widest one and joined into one array, so each
+        # keycode is summed over every day by one C-level sum()
+        cursor.execute('''
+            SELECT MAX(length(counts)) FROM keyboard_daily
+            WHERE date BETWEEN ? AND ?
+        ''', (start_date, end_date))
+        width = (cursor.fetchone()[0] or 0) // 4
+        cursor.execute('''
+            SELECT CAST(counts || zeroblob(? - length(counts)) AS BLOB)
+                AS counts
+            FROM keyboard_daily
+            WHERE date BETWEEN ? AND ?
+        ''', (width * 4, start_date, end_date))
+        days = array('I')
+        days.frombytes(b''.join(row['counts'] for row in cursor))
+        if sys.byteorder == 'big':
+            days.byteswap()
+        totals = [sum(days[keycode::width]) for keycode in range(width)]
+
+        cursor.execute('''
+            SELECT keycodes.keycode, key_names.name
+            FROM keycodes
+            JOIN key_names ON key_names.id = keycodes.key_id
+        ''')
+        names = {row['keycode']: row['name'] for row in cursor.fetchall()}
+        conn.close()
+
+        keys = {}
+        for keycode, count in enumerate(totals):
+            if count:
+                name = names.get(keycode, '[keycode {}]'.format(keycode))
+                keys[name] = keys.get(name, 0) + count
+
+        return dict(sorted(keys.items(), key=lambda item: item[1],
+                           reverse=True))
+
 
 # Example usage and testing
 if __name__ == '__main__':
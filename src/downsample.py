@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Downsample - Fit long histories into the pixels a chart actually has
+#
+# Column charts are regrouped into weekly, monthly or yearly totals until
+# they fit, so the chart gets a bounded number of columns and its render
+# time does not grow with the history. Shared by the Statistics windows
+# (graph.py, cairograph.py) and the report command.
+
+from datetime import date
+
+# Horizontal pixels needed by one category of a column chart (two series)
+COLUMN_PIXELS = 12
+
+# Seconds between live updates of today's column
+LIVE_UPDATE_SECONDS = 5
+
+# Coarser groupings tried in order, as (name, date -> label)
+BUCKETS = (
+    ('week', lambda d: '{0}-W{1:02d}'.format(*d.isocalendar()[:2])),
+    ('month', lambda d: d.strftime('%Y-%m')),
+    ('year', lambda d: d.strftime('%Y')),
+)
+
+BUCKET_SUBTITLES = {
+    'week': 'weekly totals',
+    'month': 'monthly totals',
+    'year': 'yearly totals',
+}
+
+
+def bucket_columns(days, series, width):
+    """Regroup daily columns into totals per week, month or year
+
+    Args:
+        days: Sorted days 'YYYY-MM-DD'
+        series: Lists of daily values, one per series
+        width: Width of the chart in pixels
+
+    Returns:
+        Tuple (labels, series, bucket), bucket being None when the days
+        already fit, else 'week', 'month' or 'year'
+    """
+    max_columns = max(1, width // COLUMN_PIXELS)
+    if len(days) <= max_columns:
+        return days, series, None
+    parsed = [date.fromisoformat(day) for day in days]
+    for bucket, get_label in BUCKETS:
+        labels = []
+        totals = [[] for _ in series]
+        for i, day in enumerate(parsed):
+            label = get_label(day)
+            if not labels or labels[-1] != label:
+                labels.append(label)
+                for values in totals:
+                    values.append(0)
+            for values, source in zip(totals, series):
+                values[-1] += source[i]
+        if len(labels) <= max_columns:
+            break
+    return labels, totals, bucket
+
+
+def bucket_subtitle(subtitle, bucket):
+    """The subtitle, naming the grouping when bucket_columns regrouped"""
+    if bucket is None:
+        return subtitle
+    return '{} ({})'.format(subtitle, BUCKET_SUBTITLES[bucket])
+
+
+def follows_live(days, bucket, today, end_date=None):
+    """Whether a chart's last column is today's and is kept updated live
+
+    A daily chart also follows when it has no column for today yet but its
+    range includes today, as on the first opening of the day before
+    anything was saved: the first live update then appends the column.
+
+    Args:
+        days: Column labels, as returned by bucket_columns
+        bucket: Grouping returned by bucket_columns
+        today: Today 'YYYY-MM-DD'
+        end_date: Last day of the range 'YYYY-MM-DD', None for all time
+    """
+    if bucket is not None:
+        return False
+    if days and days[-1] >= today:
+        return days[-1] == today
+    return end_date is None or end_date >= today
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Exporter - Stream tracked data to CSV, JSON Lines or an SQL dump
+#
+# Rows are pulled from SQLite in small batches and written as they arrive,
+# so memory use does not depend on how much history is stored. The
+# database is opened read-only and every table is read in one
+# transaction, so the export is a consistent snapshot.
+
+import csv
+import json
+import os
+import sys
+from database import connect_read_only, unpack_counts, DB_FILE
+
+# Exported columns for each table, in output order
+TABLES = {
+    'daily_stats': ('date', 'distance', 'clicks', 'keys'),
+    'mouse_buttons': ('date', 'button', 'count'),
+    'mouse_buttons_monthly': ('month', 'button', 'count'),
+    'keyboard_keys': ('key_name', 'count'),
+    # One row per day and keycode pressed (see iter_keyboard_daily)
+    'keyboard_daily': ('date', 'keycode', 'key_name', 'count'),
+    'preferences': ('key', 'value'),
+}
+
+# Exported columns that are not stored as such in the table
+COLUMN_EXPRESSIONS = {
+    'keyboard_keys': {
+        'key_name': '(SELECT name FROM key_names WHERE id = key_id)',
+    },
+}
+
+# Tables as stored, for the SQL dump (key_names must come first)
+SQL_TABLES = {
+    'key_names': ('id', 'name'),
+    'keyboard_keys': ('key_id', 'count'),
+    'keyboard_daily': ('date', 'counts'),
+    'keycodes': ('keycode', 'key_id'),
+}
+
+# Tables that can be filtered by date, with their date column
+DATED_TABLES = {
+    'daily_stats': 'date',
+    'mouse_buttons': 'date',
+    # 'YYYY-MM-01', rows of every month overlapping the range are kept
+    'mouse_buttons_monthly': 'month',
+    'keyboard_daily': 'date',
+}
+
+FORMATS = ('csv', 'jsonl', 'sql')
+
+BATCH_SIZE = 500
+
+
+def build_query(table, columns, start_date=None, end_date=None,
+                order_by=None):
+    """Build the SELECT for a table with the date range pushed into SQL
+
+    Returns:
+        Tuple (sql, params)
+    """
+    order_by = order_by or TABLES[table][0]
+    conditions = []
+    params = []
+    if table in DATED_TABLES:
+        column = DATED_TABLES[table]
+        if start_date:
+            if column == 'month':
+                start_date = start_date[:7] + '-01'
+            conditions.append('{} >= ?'.format(column))
+            params.append(start_date)
+        if end_date:
+            conditions.append('{} <= ?'.format(column))
+            params.append(end_date)
+
+    expressions = COLUMN_EXPRESSIONS.get(table, {})
+    selected = ', '.join(
+        '{} AS {}'.format(expressions[c], c) if c in expressions else c
+        for c in columns)
+    sql = 'SELECT {} FROM {}'.format(selected, table)
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    # The dated tables have a UNIQUE index starting with their date, so
+    # long histories come out in index order without a temporary sort
+    sql += ' ORDER BY {}'.format(order_by)
+    return sql, params
+
+
+def iter_rows(conn, table, start_date=None, end_date=None, columns=None,
+              order_by=None):
+    """Yield rows of a table as tuples, fetching BATCH_SIZE at a time"""
+    sql, params = build_query(table, columns or TABLES[table],
+                              start_date, end_date, order_by)
+    cursor = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield tuple(row)
+    finally:
+        cursor.close()
+
+
+def iter_keyboard_daily(conn, start_date=None, end_date=None):
+    """Yield (date, keycode, key name, count) for every keycode pressed"""
+    names = dict(conn.execute('''
+        SELECT keycodes.keycode, key_names.name
+        FROM keycodes
+        JOIN key_names ON key_names.id = keycodes.key_id
+    ''').fetchall())
+    for date, counts in iter_rows(conn, 'keyboard_daily', start_date,
+                                  end_date, columns=('date', 'counts')):
+        for keycode, count in enumerate(unpack_counts(counts)):
+            if count:
+                yield date, keycode, names.get(keycode), count
+
+
+def iter_table(conn, table, start_date=None, end_date=None):
+    """Yield the exported rows of a table, in TABLES column order"""
+    if table == 'keyboard_daily':
+        return iter_keyboard_daily(conn, start_date, end_date)
+    return iter_rows(conn, table, start_date, end_date)
+
+
+def export_csv(conn, tables, directory, start_date=None, end_date=None):
+    """Write one <table>.csv file per table into directory"""
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    for table in tables:
+        filename = os.path.join(directory, '{}.csv'.format(table))
+        with open(filename, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(TABLES[table])
+            writer.writerows(iter_table(conn, table, start_date, end_date))
+
+
+def iter_jsonl(conn, tables, start_date=None, end_date=None):
+    """Yield one JSON document per row, tagged with its table"""
+    for table in tables:
+        columns = TABLES[table]
+        for row in iter_table(conn, table, start_date, end_date):
+            record = {'table': table}
+            record.update(zip(columns, row))
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def iter_sql(conn, tables, start_date=None, end_date=None):
+    """Yield an SQL script that recreates the exported tables
+
+    The INSERT statements are built by SQLite itself with quote(), so
+    values are escaped exactly as the sqlite3 shell would.
+    """
+    yield 'BEGIN TRANSACTION;\n'
+    tables = list(tables)
+    if 'keyboard_daily' in tables and 'keycodes' not in tables:
+        tables.append('keycodes')
+    if ('keyboard_keys' in tables or 'keycodes' in tables) and \
+            'key_names' not in tables:
+        tables.insert(0, 'key_names')
+    for table in tables:
+        row = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name=?",
+            (table,)).fetchone()
+        if row is None:
+            continue
+        yield '{};\n'.format(row[0].replace(
+            'CREATE TABLE', 'CREATE TABLE IF NOT EXISTS', 1))
+        columns = SQL_TABLES.get(table, TABLES.get(table))
+        statement = "'INSERT INTO {}({}) VALUES(' || {} || ');'".format(
+            table, ','.join(columns),
+            " || ',' || ".join('quote({})'.format(c) for c in columns))
+        for (line,) in iter_rows(conn, table, start_date, end_date,
+                                 columns=(statement,), order_by=columns[0]):
+            yield line + '\n'
+    yield 'COMMIT;\n'
+
+
+def export(fmt, output, tables=None, start_date=None, end_date=None,
+           db_file=None):
+    """Export tables in the given format
+
+    Args:
+        fmt: One of FORMATS
+        output: Directory for 'csv'; file name or '-' (stdout) otherwise
+        tables: Table names to export (defaults to all of TABLES)
+        start_date: Optional first date 'YYYY-MM-DD' (inclusive)
+        end_date: Optional last date 'YYYY-MM-DD' (inclusive)
+        db_file: Database to read (defaults to the user database)
+    """
+    tables = tables or list(TABLES)
+    conn = connect_read_only(db_file if db_file is not None else DB_FILE)
+    try:
+        conn.execute('BEGIN')
+        # Databases from older versions may lack the newer tables
+        tables = [table for table in tables if conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+            (table,)).fetchone() is not None]
+        if fmt == 'csv':
+            export_csv(conn, tables, output, start_date, end_date)
+            return
+        if fmt == 'jsonl':
+            lines = iter_jsonl(conn, tables, start_date, end_date)
+        else:
+            lines = iter_sql(conn, tables, start_date, end_date)
+        if output == '-':
+            sys.stdout.writelines(lines)
+        else:
+            with open(output, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+    finally:
+        conn.close()
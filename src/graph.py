@@ -33,14 +33,32 @@ except ValueError as e:
 from gi.repository import Gtk
 from gi.repository import WebKit2
 from gi.repository import GLib
+import json
+import time
 import config
-from basedialog import BaseDialog
-from configurator import Configuration
+from basedialog import LiveChartDialog
+from database import Database
+from downsample import bucket_columns, bucket_subtitle, COLUMN_PIXELS
 
 
-class Graph(BaseDialog):
+# Chart width assumed while the WebView has not been allocated yet
+DEFAULT_CHART_WIDTH = 900
+
+# Milliseconds without resizing before the columns are regrouped
+RESIZE_DELAY_MS = 250
+
+
+class Graph(LiveChartDialog):
     def __init__(self, title='', subtitle='', days='', distance='', clics='',
-                 keys=''):
+                 keys='', live_source=None, visible=True):
+        """live_source: optional callable returning (day, counters) with
+        today's in-memory counters, or None when nothing is tracked.
+        visible: False creates the window hidden, to prewarm the WebView"""
+        self.open_started = None
+        self.loaded = False
+        # Width the data was last regrouped for, and the pending regroup
+        self.bucket_width = None
+        self.resize_timer = None
         self.title = title
         self.subtitle = subtitle
         self.days = days
@@ -48,12 +66,10 @@ class Graph(BaseDialog):
         self.clics = clics
         self.keys = keys
         self.is_fullscreen = False
-        BaseDialog.__init__(self, title, None, ok_button=False,
-                            cancel_button=False, modal=False,
-                            resizable=True)
+        LiveChartDialog.__init__(self, title, live_source, visible)
 
     def init_ui(self):
-        BaseDialog.init_ui(self)
+        LiveChartDialog.init_ui(self)
 
         self.scrolledwindow1 = Gtk.ScrolledWindow()
         self.scrolledwindow1.set_policy(Gtk.PolicyType.AUTOMATIC,
@@ -67,6 +83,9 @@ class Graph(BaseDialog):
         content_manager.register_script_message_handler('fullscreen')
         content_manager.connect('script-message-received::fullscreen',
                                 self.on_fullscreen_message)
+        content_manager.register_script_message_handler('painted')
+        content_manager.connect('script-message-received::painted',
+                                self.on_painted_message)
 
         # Create WebView with the content manager
         self.viewer = WebKit2.WebView(user_content_manager=content_manager)
@@ -84,44 +103,136 @@ class Graph(BaseDialog):
         self.viewer.connect('load-changed', self.load_changed)
         self.viewer.connect('decide-policy', self.on_decide_policy)
         self.viewer.connect('notify::title', self.on_title_changed)
+        self.viewer.connect('size-allocate', self.on_size_allocate)
         self.set_focus(self.viewer)
 
         # Allow F11 to exit fullscreen
         self.connect('key-press-event', self.on_key_press)
 
-    def update(self):
-        configuration = Configuration()
-        preferences = configuration.get('preferences')
+        # Closing only hides the window, so the WebView and its scripts
+        # are reused the next time (see Indicator.show_statistics)
+        self.connect('delete-event', self.on_delete_event)
+
+    def on_delete_event(self, widget, event):
+        self.close_graph()
+        return True
+
+    def close_graph(self):
+        if self.is_fullscreen:
+            self.toggle_fullscreen()
+        self.hide()
+
+    def open_graph(self):
+        """Show the window; the time until the chart is painted is printed"""
+        self.open_started = time.perf_counter()
+        self.show_all()
+        self.present()
+
+    def on_painted_message(self, content_manager, js_result):
+        try:
+            message = json.loads(js_result.get_js_value().to_string())
+        except (ValueError, AttributeError):
+            message = {}
+        if 'first_chart_ms' in message:
+            print('Statistics page load to first chart: {:.0f} ms'.format(
+                message['first_chart_ms']))
+        if self.open_started is not None:
+            print('Statistics painted {:.0f} ms after opening'.format(
+                (time.perf_counter() - self.open_started) * 1000))
+            self.open_started = None
+
+    def set_live_point(self, point):
+        """Update the last point in place, or append a day after midnight"""
+        if self.loaded:
+            self.web_call('set_last_point', point)
+
+    def get_preferences(self):
+        preferences = dict(config.PARAMS['preferences'])
+        preferences.update(Database().get_all_preferences())
+        return preferences
+
+    def update(self, title=None, subtitle=None, days=None, distance=None,
+               clics=None, keys=None, end_date=None):
+        """Send the chart data, colours and units in one message
+
+        The page updates the existing series in place and redraws once.
+        end_date is the last day of the range, None for all time.
+        """
+        if days is not None:
+            self.title = title if title is not None else self.title
+            self.subtitle = subtitle if subtitle is not None else \
+                self.subtitle
+            self.days = days
+            self.distance = distance
+            self.clics = clics
+            self.keys = keys
+            self.end_date = end_date
+        if not self.loaded:
+            # Sent by load_changed once the page is ready
+            return
+        preferences = self.get_preferences()
         units = preferences['units']
-        distance = []
         if units == 'feets':
-            for i in self.distance:
-                distance.append(i/3.28084)
+            distance = [i / 3.28084 for i in self.distance]
         else:
-            distance = self.distance
-
-        self.web_send('title="{}";subtitle="{}";days={};distance={};\
-            clics={};keys={};draw_graph(title,subtitle,days,distance,\
-                clics, keys);'.format(self.title, self.subtitle, self.days,
-                                      distance, self.clics, self.keys))
+            distance = list(self.distance)
+
+        # Regroup long ranges so every column keeps a few pixels
+        width = self.get_chart_width()
+        self.bucket_width = width
+        days, (distance, clics, keys), bucket = bucket_columns(
+            list(self.days), [distance, list(self.clics), list(self.keys)],
+            width)
+        self.set_live_follows(days, bucket)
+        self.web_call('set_data', {
+            'title': self.title,
+            'subtitle': bucket_subtitle(self.subtitle, bucket),
+            'days': days,
+            'distance': distance,
+            'clics': clics,
+            'keys': keys,
+            'colors': {
+                'distance': preferences['distance-color'],
+                'clics': preferences['clics-color'],
+                'keys': preferences['keys-color'],
+            },
+            'units': units,
+        })
+
+    def get_chart_width(self):
+        return max(self.viewer.get_allocated_width(), DEFAULT_CHART_WIDTH)
+
+    def on_size_allocate(self, widget, allocation):
+        """Regroup the columns for the new width, once resizing settles"""
+        if not self.loaded or self.bucket_width is None:
+            return
+        columns = self.get_chart_width() // COLUMN_PIXELS
+        # Only a change in how many columns fit can change the grouping
+        if columns == self.bucket_width // COLUMN_PIXELS or \
+                len(self.days) <= min(columns,
+                                      self.bucket_width // COLUMN_PIXELS):
+            return
+        if self.resize_timer is not None:
+            GLib.source_remove(self.resize_timer)
+        self.resize_timer = GLib.timeout_add(RESIZE_DELAY_MS, self.on_resized)
+
+    def on_resized(self):
+        self.resize_timer = None
+        self.update()
+        return False
 
     def load_changed(self, widget, load_event):
         if load_event == WebKit2.LoadEvent.FINISHED:
+            self.loaded = True
             self.update()
-            configuration = Configuration()
-            preferences = configuration.get('preferences')
-            distance_color = preferences['distance-color']
-            clics_color = preferences['clics-color']
-            keys_color = preferences['keys-color']
-            units = preferences['units']
-            self.web_send('set_colors("{}", "{}", "{}");'.format(
-                distance_color, clics_color, keys_color
-            ))
-            self.web_send('set_units("{}");'.format(units))
             while Gtk.events_pending():
                 Gtk.main_iteration()
             GLib.idle_add(self._reflow_chart)
 
+    def web_call(self, function, payload):
+        """Call a page function with a JSON payload as its argument"""
+        self.web_send('{}({});'.format(function, json.dumps(payload)))
+
     def web_send(self, msg):
         self.viewer.run_javascript(msg, None, None, None)
 
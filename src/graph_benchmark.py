@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Statistics benchmark: time from opening the window to the chart with the
+# data painted on screen
+#
+# Each mode runs in a fresh process with a temporary HOME and a database
+# seeded with --days days of counts, and opens the window the way
+# Indicator.show_statistics does:
+#
+#   new       a new Graph for every opening, destroyed on close (how
+#             Statistics worked before the window was reused)
+#   reuse     one Graph, hidden on close; the first opening is cold
+#   prewarm   one Graph created hidden, opened once its page has loaded
+#
+# The time is taken when the page reports the chart with the data painted
+# (graph.html posts a 'painted' message two animation frames after
+# set_data). The medians are printed; --max-reuse-ms makes it exit with
+# status 1 when reopening gets slower, so a regression is caught.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+CHILD = '''
+import datetime, json, os, sys, time
+sys.path.insert(0, {src!r})
+import graph
+from gi.repository import GLib
+from database import Database
+from livestats import LiveStats
+
+db = Database()
+today = datetime.date.today()
+for offset in range({days}):
+    day = (today - datetime.timedelta(days=offset)).strftime('%Y-%m-%d')
+    db.save_daily_stat(day, 1000 * (offset % 37), 50 + offset % 90,
+                       900 + offset % 700)
+loop = GLib.MainLoop()
+painted = []
+
+
+def fetch():
+    stats = LiveStats().get_all_stats()
+    days = sorted(stats)
+    return ('Habits', 'benchmark', days,
+            [stats[day]['distance'] / 1000.0 for day in days],
+            [stats[day]['clics'] for day in days],
+            [stats[day]['keys'] for day in days])
+
+
+class TimedGraph(graph.Graph):
+    started = None
+    delivered = False
+
+    def deliver(self, data):
+        self.delivered = True
+        self.update(*data)
+
+    def on_painted_message(self, content_manager, js_result):
+        graph.Graph.on_painted_message(self, content_manager, js_result)
+        # Only the paint after the data arrived counts, not the empty
+        # chart drawn when the page finishes loading first
+        if self.started is not None and self.delivered:
+            painted.append((time.perf_counter() - self.started) * 1000)
+            self.started = None
+            loop.quit()
+
+
+def on_timeout():
+    print('Timed out waiting for the chart', file=sys.stderr, flush=True)
+    os._exit(1)
+
+
+def open_once(window):
+    window.delivered = False
+    window.started = time.perf_counter()
+    window.open_graph()
+    window.load_async(fetch, window.deliver)
+    timeout = GLib.timeout_add_seconds({timeout}, on_timeout)
+    loop.run()
+    GLib.source_remove(timeout)
+
+
+def wait_loaded(window):
+    def check():
+        if window.loaded:
+            loop.quit()
+            return False
+        return True
+    GLib.timeout_add(10, check)
+    loop.run()
+
+
+mode = {mode!r}
+window = None
+for _ in range({runs}):
+    if window is None:
+        window = TimedGraph(visible=(mode != 'prewarm'))
+        if mode == 'prewarm':
+            wait_loaded(window)
+    open_once(window)
+    if mode == 'new':
+        window.destroy()
+        window = None
+    else:
+        window.close_graph()
+print(json.dumps(painted), flush=True)
+'''
+
+
+def run_mode(mode, runs, days, timeout):
+    """Open the Statistics window runs times, return the times in ms"""
+    source = CHILD.format(src=os.path.dirname(os.path.abspath(__file__)),
+                          mode=mode, runs=runs, days=days, timeout=timeout)
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home)
+        output = subprocess.run([sys.executable, '-c', source], env=env,
+                                stdout=subprocess.PIPE, check=True,
+                                timeout=60 + runs * timeout).stdout
+    # Graph and the WebView print too; the report is the last line
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def describe(label, times):
+    print('{}: {:.0f} ms (median of {}, {:.0f}-{:.0f})'.format(
+        label, statistics.median(times), len(times), min(times),
+        max(times)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--days', type=int, default=365,
+                        help='days of counts in the database')
+    parser.add_argument('--timeout', type=int, default=30,
+                        help='seconds to wait for each chart')
+    parser.add_argument('--max-reuse-ms', type=float,
+                        help='fail if reopening the window is slower')
+    args = parser.parse_args()
+
+    new = run_mode('new', args.runs, args.days, args.timeout)
+    reuse = run_mode('reuse', args.runs + 1, args.days, args.timeout)
+    prewarm = [run_mode('prewarm', 1, args.days, args.timeout)[0]
+               for _ in range(args.runs)]
+    describe('New window every time (before)', new)
+    describe('Reused window, first opening', reuse[:1])
+    describe('Reused window, reopening', reuse[1:])
+    describe('Prewarmed window, first opening', prewarm)
+
+    if args.max_reuse_ms is not None and \
+            statistics.median(reuse[1:]) > args.max_reuse_ms:
+        print('Reopening over the {:.0f} ms limit'.format(args.max_reuse_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
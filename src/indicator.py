@@ -38,18 +38,28 @@ from gi.repository import Gdk
 from gi.repository import GLib
 from gi.repository import AppIndicator3
 from gi.repository import GdkPixbuf
-import webbrowser
 from config import _
 from monitor import Monitor
-from graph import Graph
-from preferences import Preferences
-from secretdialog import SecretDialog
-from buttonstatsdialog import ButtonStatsDialog
-from keyboardstatsdialog import KeyboardStatsDialog
-from daterangedialog import DateRangeDialog
 import config
 from configurator import Configuration
-from datetime import datetime, timedelta
+from maintenance import Maintenance
+from livestats import LiveStats
+from threading import Thread
+
+# The dialogs, WebKit, the backup and RAM store modules and webbrowser
+# are imported when first used, so the tray icon shows up without paying
+# for them (see startup_benchmark.py)
+
+# How often to check whether idle-time maintenance is due
+MAINTENANCE_CHECK_SECONDS = 300
+
+# Delay before the Statistics window is prewarmed, when enabled
+PREWARM_DELAY_SECONDS = 30
+
+
+def open_url(url):
+    import webbrowser
+    webbrowser.open(url)
 
 
 class Indicator(object):
@@ -64,11 +74,28 @@ class Indicator(object):
         # self.indicator.set_label('', '')  # Commented out to prevent notifications
         self.indicator.set_status(AppIndicator3.IndicatorStatus.ACTIVE)
         self.monitor = None
+        self.save_timer = None
+        self.save_thread = None
+        self.maintenance_thread = None
+        self.ram_store = None
+        self.graph = None
+        self.graph_renderer = None
+        self.counters_timer = None
+        self.counters_text = None
+        self.counters_label = False
         self.load_preferences()
+        self.set_live_counters()
+        if self.preferences.get('storage-mode') == 'memory':
+            self.start_ram_store()
         if self.start_actived:
             self.start()
         else:
             self.stop()
+        GLib.timeout_add_seconds(MAINTENANCE_CHECK_SECONDS,
+                                 self.on_maintenance_tick)
+        if self.preferences.get('prewarm-statistics', False):
+            GLib.timeout_add_seconds(PREWARM_DELAY_SECONDS,
+                                     self.prewarm_statistics)
         Gtk.main()
 
     def set_icon(self, active=True):
@@ -87,11 +114,130 @@ class Indicator(object):
     def load_preferences(self):
         configuration = Configuration()
         preferences = configuration.get('preferences')
+        self.preferences = preferences
         self.theme_light = preferences['theme-light']
         self.start_actived = preferences['start-actived']
 
+    def start_ram_store(self):
+        """Work on an in-memory copy of the database (see ramstore.py)"""
+        from ramstore import RamStore, SleepWatcher
+        self.ram_store = RamStore()
+        self.ram_store.load()
+        minutes = max(1, int(self.preferences.get('checkpoint-minutes', 15)))
+        GLib.timeout_add_seconds(minutes * 60, self.on_checkpoint_tick)
+        try:
+            self.sleep_watcher = SleepWatcher(self.checkpoint)
+        except Exception as e:
+            print('Not watching for suspend: {}'.format(e))
+            self.sleep_watcher = None
+
+    def checkpoint(self):
+        if self.monitor is not None:
+            self.monitor.save()
+        self.ram_store.checkpoint()
+
+    def on_checkpoint_tick(self):
+        try:
+            self.checkpoint()
+        except Exception as e:
+            print('Error writing checkpoint: {}'.format(e))
+        return True
+
+    def on_save_tick(self):
+        """Save the monitor's counters in the background"""
+        if self.save_thread is not None and self.save_thread.is_alive():
+            return True
+        self.save_thread = Thread(target=self.save_monitor,
+                                  args=(self.monitor,), daemon=True)
+        self.save_thread.start()
+        return True
+
+    def save_monitor(self, monitor):
+        try:
+            monitor.save()
+        except Exception as e:
+            print('Error saving data: {}'.format(e))
+
+    def on_maintenance_tick(self):
+        """Start database maintenance in the background when the user is idle"""
+        if self.maintenance_thread is not None and \
+                self.maintenance_thread.is_alive():
+            return True
+        if self.monitor is not None:
+            idle_seconds = self.monitor.get_idle_seconds()
+        else:
+            idle_seconds = float('inf')
+        maintenance = Maintenance(self.preferences)
+        if maintenance.is_due(idle_seconds):
+            self.maintenance_thread = Thread(target=maintenance.run,
+                                             daemon=True)
+            self.maintenance_thread.start()
+        return True
+
+    def set_live_counters(self):
+        """Start or stop showing today's counters, as set in Preferences"""
+        mode = self.preferences.get('live-counters', 'off')
+        if self.counters_timer is not None:
+            GLib.source_remove(self.counters_timer)
+            self.counters_timer = None
+        self.counters_text = None
+        if self.counters_label:
+            # Only touched when it was set: updating the label can
+            # trigger panel notifications
+            self.indicator.set_label('', '')
+            self.counters_label = False
+        if mode == 'off':
+            self.menu_counters.hide()
+            self.menu_counters_separator.hide()
+            return
+        self.menu_counters.show()
+        self.menu_counters_separator.show()
+        seconds = max(1, int(self.preferences.get('live-counters-seconds',
+                                                  10)))
+        self.on_counters_tick()
+        # Whole seconds, so GLib can wake us up along with other timers
+        self.counters_timer = GLib.timeout_add_seconds(seconds,
+                                                       self.on_counters_tick)
+
+    def format_counters(self, counters):
+        distance = counters.get('distance', 0) / 1000.0
+        if self.preferences.get('units') == 'feets':
+            distance = '{:,.0f} ft'.format(distance * 3.28084)
+        elif distance >= 1000:
+            distance = '{:,.2f} km'.format(distance / 1000.0)
+        else:
+            distance = '{:,.0f} m'.format(distance)
+        return '{:,}'.format(counters.get('keys', 0)), \
+            '{:,}'.format(counters.get('clics', 0)), distance
+
+    def on_counters_tick(self):
+        """Refresh the counters, touching the menu only if they changed"""
+        live = self.get_live_counters()
+        counters = live[1] if live is not None else {}
+        keys, clics, distance = self.format_counters(counters)
+        text = _('Today: {0} keys, {1} clicks, {2}').format(
+            keys, clics, distance)
+        if text == self.counters_text:
+            return True
+        self.counters_text = text
+        self.menu_counters.set_label(text)
+        if self.preferences.get('live-counters') == 'label':
+            self.indicator.set_label('{} ⌨ {} 🖱'.format(keys, clics),
+                                     '000,000 ⌨ 000,000 🖱')
+            self.counters_label = True
+        return True
+
     def build_menu(self):
         menu = Gtk.Menu()
+        # Today's counters, shown when enabled in Preferences
+        self.menu_counters = Gtk.MenuItem.new_with_label('')
+        self.menu_counters.set_sensitive(False)
+        self.menu_counters.set_no_show_all(True)
+        menu.append(self.menu_counters)
+        self.menu_counters_separator = Gtk.SeparatorMenuItem()
+        self.menu_counters_separator.set_no_show_all(True)
+        menu.append(self.menu_counters_separator)
+
         self.menu_toggle_service = Gtk.MenuItem.new_with_label(
             _('Start monitor'))
         self.menu_toggle_service.connect('activate', self.toggle_service)
@@ -125,6 +271,10 @@ class Indicator(object):
         menu_settings.connect('activate', self.show_settings)
         menu.append(menu_settings)
 
+        self.menu_backup = Gtk.MenuItem.new_with_label(_('Backup now'))
+        self.menu_backup.connect('activate', self.backup)
+        menu.append(self.menu_backup)
+
         menu_preferences = Gtk.MenuItem.new_with_label(_('Preferences'))
         menu_preferences.connect('activate', self.show_preferences)
         menu.append(menu_preferences)
@@ -143,6 +293,7 @@ class Indicator(object):
 
     def show_settings(self, widget):
         widget.set_sensitive(False)
+        from daterangedialog import DateRangeDialog
         settings_dialog = DateRangeDialog()
         response = settings_dialog.run()
         if response == Gtk.ResponseType.ACCEPT:
@@ -150,53 +301,68 @@ class Indicator(object):
         settings_dialog.destroy()
         widget.set_sensitive(True)
 
+    def backup(self, widget):
+        widget.set_sensitive(False)
+        from backup import Backup
+        backup = Backup(keep=self.preferences.get('backup-keep', 7))
+
+        def do_backup():
+            try:
+                print('Backup saved to {}'.format(backup.run()))
+            except Exception as e:
+                print('Error creating backup: {}'.format(e))
+            GLib.idle_add(widget.set_sensitive, True)
+
+        Thread(target=do_backup, daemon=True).start()
+
     def show_preferences(self, widget):
         widget.set_sensitive(False)
+        from preferences import Preferences
         preferences = Preferences()
         response = preferences.run()
         if response == Gtk.ResponseType.ACCEPT:
             preferences.save()
             self.load_preferences()
             self.set_icon(self.is_monitoring)
+            self.set_live_counters()
         preferences.destroy()
         widget.set_sensitive(True)
 
     def show_statistics(self, widget):
         widget.set_sensitive(False)
 
-        if self.is_monitoring and self.monitor is not None:
-            self.monitor.save()
+        # The window opens at once; the data follows from a worker thread
+        graph = self.get_graph()
+        graph.open_graph()
+        graph.load_async(self.get_statistics, lambda data: graph.update(*data))
+        graph.run()
+        graph.close_graph()
+        widget.set_sensitive(True)
+
+    def get_statistics(self):
+        """Title, subtitle, columns and range end for the Statistics chart
 
+        The range end ('YYYY-MM-DD', None for all time) lets the chart
+        follow today's counters before today has any stored row.
+        """
         title = _('Habits')
         configuration = Configuration()
         preferences = configuration.get('preferences')
-
-        # Get the date range preference (default to 14 days)
-        date_range_days = preferences.get('stats-date-range', 14)
-
-        today = datetime.now().date()
+        live_stats = self.get_live_stats()
 
         # Get filtered stats based on saved preference
-        if date_range_days == -1:
-            # All time
+        start_date, end_date = configuration.get_stats_date_range()
+        if start_date is None:
             subtitle = _('Mouse and keyboard - All time')
-            stats = configuration.get('stats')
-        elif date_range_days == 0:
-            # Custom range
-            start_date = preferences.get('stats-custom-start', (today - timedelta(days=13)).strftime('%Y-%m-%d'))
-            end_date = preferences.get('stats-custom-end', today.strftime('%Y-%m-%d'))
-            subtitle = _('Mouse and keyboard - {0} to {1}').format(start_date, end_date)
-
-            # Get stats for date range from database
-            stats = configuration.db.get_stats_by_date_range(start_date, end_date)
+            stats = live_stats.get_all_stats()
         else:
-            # Last N days
-            start_date = (today - timedelta(days=date_range_days - 1)).strftime('%Y-%m-%d')
-            end_date = today.strftime('%Y-%m-%d')
-            subtitle = _('Mouse and keyboard - Last {0} days').format(date_range_days)
-
-            # Get stats for date range from database
-            stats = configuration.db.get_stats_by_date_range(start_date, end_date)
+            if preferences.get('stats-date-range', 14) == 0:
+                subtitle = _('Mouse and keyboard - {0} to {1}').format(
+                    start_date, end_date)
+            else:
+                subtitle = _('Mouse and keyboard - Last {0} days').format(
+                    preferences.get('stats-date-range', 14))
+            stats = live_stats.get_stats_by_date_range(start_date, end_date)
 
         days = []
         distance = []
@@ -217,18 +383,46 @@ class Indicator(object):
             else:
                 keys.append(0)
 
-        graph = Graph(title, subtitle, days, distance, clics, keys)
-        graph.run()
-        graph.destroy()
-        widget.set_sensitive(True)
+        return title, subtitle, days, distance, clics, keys, end_date
+
+    def get_graph(self, visible=True):
+        """The Statistics window, created once and hidden between uses"""
+        renderer = self.preferences.get('chart-renderer', 'webkit')
+        if self.graph is not None and self.graph_renderer != renderer:
+            self.graph.destroy()
+            self.graph = None
+        if self.graph is None:
+            if renderer == 'cairo':
+                from cairograph import CairoGraph
+                graph_class = CairoGraph
+            else:
+                from graph import Graph
+                graph_class = Graph
+            self.graph = graph_class(live_source=self.get_live_counters,
+                                     visible=visible)
+            self.graph_renderer = renderer
+        return self.graph
+
+    def prewarm_statistics(self):
+        """Load the Statistics page in a hidden window ahead of time"""
+        self.get_graph(visible=False)
+        return False
+
+    def get_live_stats(self):
+        """Database reads including what the monitor has not saved yet"""
+        return LiveStats(self.monitor)
+
+    def get_live_counters(self):
+        """Today's counters from the running monitor, for live charts"""
+        if self.monitor is None:
+            return None
+        return self.monitor.get_today()
 
     def show_secret(self, widget):
         widget.set_sensitive(False)
 
-        if self.is_monitoring and self.monitor is not None:
-            self.monitor.save()
-
-        secret_dialog = SecretDialog()
+        from secretdialog import SecretDialog
+        secret_dialog = SecretDialog(self.get_live_stats())
         secret_dialog.run()
         secret_dialog.destroy()
         widget.set_sensitive(True)
@@ -236,10 +430,8 @@ class Indicator(object):
     def show_button_stats(self, widget):
         widget.set_sensitive(False)
 
-        if self.is_monitoring and self.monitor is not None:
-            self.monitor.save()
-
-        button_dialog = ButtonStatsDialog()
+        from buttonstatsdialog import ButtonStatsDialog
+        button_dialog = ButtonStatsDialog(self.get_live_stats())
         button_dialog.run()
         button_dialog.destroy()
         widget.set_sensitive(True)
@@ -247,10 +439,8 @@ class Indicator(object):
     def show_keyboard_stats(self, widget):
         widget.set_sensitive(False)
 
-        if self.is_monitoring and self.monitor is not None:
-            self.monitor.save()
-
-        keyboard_dialog = KeyboardStatsDialog()
+        from keyboardstatsdialog import KeyboardStatsDialog
+        keyboard_dialog = KeyboardStatsDialog(self.get_live_stats())
         keyboard_dialog.run()
         keyboard_dialog.destroy()
         widget.set_sensitive(True)
@@ -261,26 +451,26 @@ class Indicator(object):
         homepage_item = Gtk.MenuItem.new_with_label(_('Homepage'))
         homepage_item.connect(
             'activate',
-            lambda x: webbrowser.open('http://www.atareao.es/apps/habits/'))
+            lambda x: open_url('http://www.atareao.es/apps/habits/'))
         help_menu.append(homepage_item)
 
         help_item = Gtk.MenuItem.new_with_label(_('Get help online...'))
         help_item.connect(
             'activate',
-            lambda x: webbrowser.open('http://www.atareao.es/apps/habits/'))
+            lambda x: open_url('http://www.atareao.es/apps/habits/'))
         help_menu.append(help_item)
 
         translate_item = Gtk.MenuItem.new_with_label(_(
             'Translate this application...'))
         translate_item.connect(
             'activate',
-            lambda x: webbrowser.open('http://www.atareao.es/apps/habits/'))
+            lambda x: open_url('http://www.atareao.es/apps/habits/'))
         help_menu.append(translate_item)
 
         bug_item = Gtk.MenuItem.new_with_label(_('Report a bug...'))
         bug_item.connect(
             'activate',
-            lambda x: webbrowser.open('https://github.com/atareao\
+            lambda x: open_url('https://github.com/atareao\
 /habits/issues'))
         help_menu.append(bug_item)
 
@@ -289,19 +479,19 @@ class Indicator(object):
         twitter_item = Gtk.MenuItem.new_with_label(_('Found me in Twitter'))
         twitter_item.connect(
             'activate',
-            lambda x: webbrowser.open('https://twitter.com/atareao'))
+            lambda x: open_url('https://twitter.com/atareao'))
         help_menu.append(twitter_item)
         #
         github_item = Gtk.MenuItem.new_with_label(_('Found me in GitHub'))
         github_item.connect(
             'activate',
-            lambda x: webbrowser.open('https://github.com/atareao'))
+            lambda x: open_url('https://github.com/atareao'))
         help_menu.append(github_item)
 
         mastodon_item = Gtk.MenuItem.new_with_label(_('Found me in Mastodon'))
         mastodon_item.connect(
             'activate',
-            lambda x: webbrowser.open('https://mastodon.social/@atareao'))
+            lambda x: open_url('https://mastodon.social/@atareao'))
         help_menu.append(mastodon_item)
 
         about_item = Gtk.MenuItem.new_with_label(_('About'))
@@ -368,6 +558,9 @@ SOFTWARE.''')
         self.is_monitoring = False
 
         self.menu_toggle_service.set_label(_('Start monitor'))
+        if self.save_timer is not None:
+            GLib.source_remove(self.save_timer)
+            self.save_timer = None
         self.monitor.stop()
         self.monitor.save()
         self.monitor = None
@@ -379,10 +572,17 @@ SOFTWARE.''')
         self.menu_toggle_service.set_label(_('Stop monitor'))
         self.monitor = Monitor()
         self.monitor.start()
+        # Saved regularly so a crash or logout loses at most save-minutes,
+        # and the collector and Monitor.evict_flushed keep up
+        minutes = max(1, int(self.preferences.get('save-minutes', 5)))
+        self.save_timer = GLib.timeout_add_seconds(minutes * 60,
+                                                   self.on_save_tick)
 
     def quit(self, menu_item):
         if self.monitor is not None:
             self.stop()
+        if self.ram_store is not None:
+            self.ram_store.close()
         Gtk.main_quit()
         # If Gtk throws an error or just a warning, main_quit() might not
         # actually close the app
@@ -11,14 +11,25 @@ except Exception as e:
     print(e)
     exit(-1)
 from gi.repository import Gtk
+from gi.repository import GObject
 from basedialog import BaseDialog
+from configurator import Configuration
 from database import Database
 
+# Columns of the keys model
+COLUMN_NAME = 0
+COLUMN_COUNT = 1
+COLUMN_SHARE = 2
+COLUMN_BAR = 3
+
 
 class KeyboardStatsDialog(BaseDialog):
     """Dialog to show individual keyboard key statistics"""
 
-    def __init__(self):
+    def __init__(self, stats=None):
+        """stats: object with the Database read methods, such as
+        LiveStats (defaults to the user database)"""
+        self.stats = stats if stats is not None else Database()
         BaseDialog.__init__(self, 'Keyboard Statistics', None,
                             ok_button=False, cancel_button=False,
                             modal=False)
@@ -26,10 +37,25 @@ class KeyboardStatsDialog(BaseDialog):
 
     def init_ui(self):
         BaseDialog.init_ui(self)
+        self.start_loading(self.fetch_data, self.populate)
+
+    def fetch_data(self):
+        """Key counts for the date range chosen in Preferences, read on a
+        worker thread"""
+        configuration = Configuration()
+        start_date, end_date = configuration.get_stats_date_range()
+        if start_date is None:
+            key_totals = self.stats.get_total_keyboard_keys()
+            info = 'Total presses for each keyboard key'
+        else:
+            key_totals = self.stats.get_keyboard_keys_by_date_range(
+                start_date, end_date)
+            info = 'Presses for each keyboard key from {} to {}'.format(
+                start_date, end_date)
+        return key_totals, info
 
-        # Get data from database
-        db = Database()
-        key_totals = db.get_total_keyboard_keys()
+    def populate(self, data):
+        key_totals, info = data
 
         # Main container
         main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=15)
@@ -48,7 +74,7 @@ class KeyboardStatsDialog(BaseDialog):
 
         # Info text
         info_label = Gtk.Label()
-        info_label.set_markup('<span size="small" style="italic">Total presses for each keyboard key</span>')
+        info_label.set_markup(f'<span size="small" style="italic">{info}</span>')
         info_label.set_halign(Gtk.Align.START)
         main_box.pack_start(info_label, False, False, 0)
 
@@ -70,39 +96,59 @@ class KeyboardStatsDialog(BaseDialog):
 
         main_box.pack_start(Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL), False, False, 5)
 
-        # Scrolled window for keys list
+        # Search entry filtering the list as you type
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.set_placeholder_text('Search keys')
+        self.search_entry.connect('search-changed', self.on_search_changed)
+        main_box.pack_start(self.search_entry, False, False, 0)
+
+        # One model row per key; the view only creates cells for the rows
+        # on screen, so any number of keys opens instantly
+        store = Gtk.ListStore(str, GObject.TYPE_INT64, float, float)
+        max_count = max(key_totals.values()) if key_totals else 0
+        for key_name, count in key_totals.items():
+            store.append([key_name, count,
+                          count * 100.0 / total_keys if total_keys else 0,
+                          count * 100.0 / max_count if max_count else 0])
+
+        self.filter = store.filter_new()
+        self.filter.set_visible_func(self.is_key_visible)
+        sorted_model = Gtk.TreeModelSort(model=self.filter)
+        sorted_model.set_sort_column_id(COLUMN_COUNT, Gtk.SortType.DESCENDING)
+
+        view = Gtk.TreeView(model=sorted_model)
+        view.set_search_column(COLUMN_NAME)
+
+        renderer = Gtk.CellRendererText()
+        column = Gtk.TreeViewColumn('Key', renderer, text=COLUMN_NAME)
+        column.set_sort_column_id(COLUMN_NAME)
+        column.set_expand(True)
+        view.append_column(column)
+
+        renderer = Gtk.CellRendererText(xalign=1.0)
+        column = Gtk.TreeViewColumn('Presses', renderer)
+        column.set_cell_data_func(renderer, self.render_count)
+        column.set_sort_column_id(COLUMN_COUNT)
+        view.append_column(column)
+
+        # Bar relative to the most pressed key, text is the share of total
+        renderer = Gtk.CellRendererProgress()
+        column = Gtk.TreeViewColumn('Share', renderer, value=COLUMN_BAR)
+        column.set_cell_data_func(renderer, self.render_share)
+        column.set_sort_column_id(COLUMN_SHARE)
+        column.set_min_width(140)
+        view.append_column(column)
+
         scrolled = Gtk.ScrolledWindow()
         scrolled.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
         scrolled.set_min_content_height(400)
-
-        # Keys list container
-        keys_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=8)
-
-        # Display keys
         if key_totals:
-            # Already sorted by count (DESC) from database
-            for key_name, count in key_totals.items():
-                hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
-
-                name_label = Gtk.Label()
-                name_label.set_markup(f'<b>{key_name}:</b>')
-                name_label.set_halign(Gtk.Align.START)
-                name_label.set_size_request(200, -1)
-
-                count_label = Gtk.Label()
-                count_label.set_markup(f'<span size="large" color="#ffffff">{count:,}</span>')
-                count_label.set_halign(Gtk.Align.END)
-
-                hbox.pack_start(name_label, True, True, 0)
-                hbox.pack_start(count_label, False, False, 0)
-                keys_box.pack_start(hbox, False, False, 0)
+            scrolled.add(view)
         else:
             no_data = Gtk.Label()
             no_data.set_markup('<span style="italic" size="large">No keyboard data yet. Start typing!</span>')
             no_data.set_halign(Gtk.Align.CENTER)
-            keys_box.pack_start(no_data, True, True, 0)
-
-        scrolled.add(keys_box)
+            scrolled.add(no_data)
         main_box.pack_start(scrolled, True, True, 0)
 
         # Close button
@@ -111,7 +157,22 @@ class KeyboardStatsDialog(BaseDialog):
         close_button.connect('clicked', lambda w: self.close())
         main_box.pack_start(close_button, False, False, 0)
 
-        self.grid.attach(main_box, 0, 0, 1, 1)
+        self.show_content(main_box)
+
+    def is_key_visible(self, model, tree_iter, data):
+        text = self.search_entry.get_text().strip().lower()
+        return not text or text in model[tree_iter][COLUMN_NAME].lower()
+
+    def on_search_changed(self, entry):
+        self.filter.refilter()
+
+    def render_count(self, column, renderer, model, tree_iter, data):
+        renderer.set_property('text', '{:,}'.format(
+            model[tree_iter][COLUMN_COUNT]))
+
+    def render_share(self, column, renderer, model, tree_iter, data):
+        renderer.set_property('text', '{:.1f} %'.format(
+            model[tree_iter][COLUMN_SHARE]))
 
     def close(self):
         self.hide()
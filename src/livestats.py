@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Live stats - Database reads that include what the monitor has not saved
+#
+# The dialogs used to force Monitor.save() before every read so the
+# current session showed up. LiveStats instead adds the monitor's pending
+# deltas (Monitor.get_pending) to the stored values, so the numbers are
+# exact without writing anything.
+
+from database import Database
+
+
+def in_range(day, start_date, end_date):
+    return start_date <= day <= end_date
+
+
+def sort_by_count(counts):
+    return dict(sorted(counts.items(), key=lambda item: item[1],
+                       reverse=True))
+
+
+class LiveStats(object):
+    """Same read methods as Database, with unsaved counts added"""
+
+    def __init__(self, monitor=None, db=None):
+        self.monitor = monitor
+        self.db = db if db is not None else Database()
+
+    def read(self, method, *args, extra=None):
+        """Call a Database method and return (result, pending deltas)
+
+        Both are read under the monitor's save lock, so a save running at
+        the same time is either fully in the result or fully pending.
+        extra, if given, is called with the pending deltas under the same
+        lock and its result returned as a third item.
+        """
+        if self.monitor is None:
+            return self.read_unlocked(method, args, extra)
+        with self.monitor.save_lock:
+            return self.read_unlocked(method, args, extra)
+
+    def read_unlocked(self, method, args, extra):
+        result = getattr(self.db, method)(*args)
+        pending = self.monitor.get_pending() if self.monitor else {}
+        if extra is None:
+            return result, pending
+        return result, pending, extra(pending)
+
+    def get_stats_by_date_range(self, start_date, end_date):
+        stats, pending = self.read('get_stats_by_date_range', start_date,
+                                   end_date)
+        for day, deltas in pending.items():
+            if in_range(day, start_date, end_date):
+                self.add_stats(stats, day, deltas)
+        return dict(sorted(stats.items()))
+
+    def get_all_stats(self):
+        stats, pending = self.read('get_all_stats')
+        for day, deltas in pending.items():
+            self.add_stats(stats, day, deltas)
+        return stats
+
+    def add_stats(self, stats, day, deltas):
+        values = stats.setdefault(day, {'distance': 0, 'clics': 0,
+                                        'keys': 0})
+        for key in ('distance', 'clics', 'keys'):
+            values[key] = (values.get(key) or 0) + deltas.get(key, 0)
+
+    def get_totals(self):
+        totals, pending, new_days = self.read('get_totals',
+                                              extra=self.get_new_days)
+        for deltas in pending.values():
+            for key in ('distance', 'clics', 'keys'):
+                totals[key] += deltas.get(key, 0)
+        totals['days'] += len(new_days)
+        return totals
+
+    def get_new_days(self, pending):
+        """Days in pending that have no row in the database yet"""
+        return [day for day in pending
+                if self.db.get_daily_stat(day) is None]
+
+    def get_total_mouse_buttons(self):
+        totals, pending = self.read('get_total_mouse_buttons')
+        for deltas in pending.values():
+            for counter, value in deltas.items():
+                if counter.startswith('Button-'):
+                    button = int(counter.split('-')[1])
+                    totals[button] = totals.get(button, 0) + value
+        return dict(sorted(totals.items()))
+
+    def get_total_keyboard_keys(self):
+        keys, pending = self.read('get_total_keyboard_keys')
+        for deltas in pending.values():
+            self.add_keys(keys, deltas)
+        return sort_by_count(keys)
+
+    def get_keyboard_keys_by_date_range(self, start_date, end_date):
+        keys, pending = self.read('get_keyboard_keys_by_date_range',
+                                  start_date, end_date)
+        for day, deltas in pending.items():
+            if in_range(day, start_date, end_date):
+                self.add_keys(keys, deltas)
+        return sort_by_count(keys)
+
+    def add_keys(self, keys, deltas):
+        for counter, value in deltas.items():
+            if counter.startswith('Key-'):
+                key_name = counter.split('-', 1)[1]
+                keys[key_name] = keys.get(key_name, 0) + value
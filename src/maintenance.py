@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Maintenance - Retention, downsampling and housekeeping for habits.db
+#
+# Everything here is meant to run while the user is idle (see
+# Indicator.on_maintenance_tick) so its I/O never competes with capture
+# or with the statistics dialogs.
+
+import time
+from datetime import datetime, timedelta
+from database import Database
+
+# Leftovers from migrate_keyboard_to_total.py
+LEFTOVER_TABLES = ('keyboard_keys_old', 'keyboard_keys_total')
+
+# Pages released per run by PRAGMA incremental_vacuum
+VACUUM_PAGES = 1024
+
+# Kept in the metadata table, next to the machine ID
+LAST_RUN_KEY = 'maintenance-last-run'
+
+
+class Maintenance(object):
+    """Keep habits.db small and its statistics fresh"""
+
+    def __init__(self, preferences, db=None):
+        """
+        Args:
+            preferences: Preferences dictionary (Configuration 'preferences')
+            db: Database to maintain (defaults to the user database)
+        """
+        self.preferences = preferences
+        self.db = db if db is not None else Database()
+
+    def get_last_run(self):
+        """Timestamp of the last completed run (0 if never)"""
+        try:
+            return float(self.db.get_metadata(LAST_RUN_KEY, 0))
+        except ValueError:
+            return 0
+
+    def is_due(self, idle_seconds):
+        """Check whether maintenance should run now
+
+        Args:
+            idle_seconds: Seconds since the last keyboard/mouse event
+
+        Returns:
+            True if the user has been idle long enough and the last run is
+            older than the configured interval
+        """
+        idle_minutes = self.preferences.get('maintenance-idle-minutes', 5)
+        interval_hours = self.preferences.get('maintenance-interval-hours',
+                                              24)
+        if idle_seconds < idle_minutes * 60:
+            return False
+        return time.time() - self.get_last_run() >= interval_hours * 3600
+
+    def run(self):
+        """Run every maintenance step and record the run
+
+        Returns:
+            Dictionary with the number of rows/pages affected by each step
+        """
+        report = {}
+        conn = self.db.connect()
+        try:
+            report['downsampled'] = self.downsample_mouse_buttons(conn)
+            report['retention'] = self.apply_retention(conn)
+            report['dropped'] = self.drop_leftover_tables(conn)
+            conn.commit()
+
+            conn.execute('ANALYZE')
+            report['vacuumed'] = self.vacuum(conn)
+            report['checkpoint'] = self.checkpoint(conn)
+        finally:
+            conn.close()
+            self.db.invalidate_cache()
+
+        self.db.save_metadata(LAST_RUN_KEY, str(time.time()))
+        return report
+
+    def get_cutoff(self, key):
+        """Oldest date to keep for a 'days' preference (None keeps all)"""
+        days = self.preferences.get(key, 0)
+        if not days or days <= 0:
+            return None
+        cutoff = datetime.now().date() - timedelta(days=days - 1)
+        return cutoff.strftime('%Y-%m-%d')
+
+    def apply_retention(self, conn):
+        """Delete rows older than the configured retention per table"""
+        deleted = 0
+        cutoff = self.get_cutoff('retention-daily-stats')
+        if cutoff:
+            cursor = conn.execute(
+                'DELETE FROM daily_stats WHERE date < ?', (cutoff,))
+            deleted += cursor.rowcount
+
+        cutoff = self.get_cutoff('retention-mouse-buttons')
+        if cutoff:
+            cursor = conn.execute(
+                'DELETE FROM mouse_buttons WHERE date < ?', (cutoff,))
+            deleted += cursor.rowcount
+            # Monthly rows are kept until their whole month falls outside
+            # the retention window
+            cursor = conn.execute(
+                'DELETE FROM mouse_buttons_monthly WHERE month < ?',
+                (cutoff[:7] + '-01',))
+            deleted += cursor.rowcount
+
+        cutoff = self.get_cutoff('retention-keyboard-daily')
+        if cutoff:
+            cursor = conn.execute(
+                'DELETE FROM keyboard_daily WHERE date < ?', (cutoff,))
+            deleted += cursor.rowcount
+        return deleted
+
+    def downsample_mouse_buttons(self, conn):
+        """Fold per-day button rows into mouse_buttons_monthly
+
+        Only whole months older than 'downsample-mouse-buttons' days are
+        folded, so get_total_mouse_buttons() is unaffected. Rows left in
+        mouse_buttons as 'YYYY-MM' by earlier versions are moved too.
+        """
+        self.fold_mouse_buttons(conn, 'length(date) = 7')
+        cutoff = self.get_cutoff('downsample-mouse-buttons')
+        if not cutoff:
+            return 0
+        return self.fold_mouse_buttons(conn, 'date < ?',
+                                       (cutoff[:7] + '-01',))
+
+    def fold_mouse_buttons(self, conn, condition, params=()):
+        """Move the mouse_buttons rows matching condition to their month"""
+        conn.execute('''
+            INSERT INTO mouse_buttons_monthly (month, button, count)
+            SELECT substr(date, 1, 7) || '-01', button, SUM(count)
+            FROM mouse_buttons
+            WHERE {}
+            GROUP BY substr(date, 1, 7), button
+            ON CONFLICT(month, button) DO UPDATE SET
+                count = count + excluded.count,
+                updated_at = CURRENT_TIMESTAMP
+        '''.format(condition), params)
+        cursor = conn.execute(
+            'DELETE FROM mouse_buttons WHERE {}'.format(condition), params)
+        return cursor.rowcount
+
+    def drop_leftover_tables(self, conn):
+        """Drop backup tables left behind by old migrations"""
+        dropped = []
+        for table in LEFTOVER_TABLES:
+            row = conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                (table,)).fetchone()
+            if row:
+                conn.execute('DROP TABLE {}'.format(table))
+                dropped.append(table)
+        return dropped
+
+    def vacuum(self, conn):
+        """Release free pages, a bounded number at a time
+
+        Databases created before auto_vacuum was enabled are rebuilt once
+        with a full VACUUM; afterwards only incremental vacuum is used.
+        """
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            return -1
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if free_pages:
+            conn.execute('PRAGMA incremental_vacuum({})'.format(
+                VACUUM_PAGES))
+        return min(free_pages, VACUUM_PAGES)
+
+    def checkpoint(self, conn):
+        """Checkpoint and truncate the WAL when the database uses one"""
+        if conn.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+            return None
+        return tuple(conn.execute(
+            'PRAGMA wal_checkpoint(TRUNCATE)').fetchone())
+
+
+if __name__ == '__main__':
+    from configurator import Configuration
+    configuration = Configuration()
+    maintenance = Maintenance(configuration.get('preferences'))
+    print(maintenance.run())
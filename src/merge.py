@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Merge - Fold habits.db files from other machines into one database
+#
+# Each source is ATTACHed and added with set-based upserts, one
+# transaction per source. Sources are identified by their machine ID and
+# what each machine had at its last merge is kept in merged_* snapshot
+# tables, so merging a machine again only adds what it recorded since.
+
+import hashlib
+import os
+from database import Database, pack_counts, unpack_counts
+
+SOURCE = 'source'
+
+# (table, key columns, columns added together); each one has a
+# merged_<table> snapshot with the same columns plus machine_id
+MERGED_TABLES = (
+    ('daily_stats', ('date',), ('distance', 'clicks', 'keys')),
+    ('mouse_buttons', ('date', 'button'), ('count',)),
+    ('mouse_buttons_monthly', ('month', 'button'), ('count',)),
+)
+
+
+def build_merge_sql(table, keys, columns):
+    """INSERT ... SELECT adding what the source gained since its snapshot"""
+    join = ' AND '.join('m.{0} = s.{0}'.format(k) for k in keys)
+    differences = ', '.join('COALESCE(s.{0}, 0) - COALESCE(m.{0}, 0)'.format(c)
+                            for c in columns)
+    changed = ' OR '.join('COALESCE(s.{0}, 0) != COALESCE(m.{0}, 0)'.format(c)
+                          for c in columns)
+    updates = ',\n'.join('{0} = {0} + excluded.{0}'.format(c)
+                         for c in columns)
+    return '''
+        INSERT INTO {table} ({keys}, {columns})
+        SELECT {source_keys}, {differences}
+        FROM {source}.{table} s
+        LEFT JOIN merged_{table} m ON m.machine_id = :machine AND {join}
+        WHERE {changed}
+        ON CONFLICT({keys}) DO UPDATE SET
+            {updates},
+            updated_at = CURRENT_TIMESTAMP
+    '''.format(table=table, keys=', '.join(keys), columns=', '.join(columns),
+               source_keys=', '.join('s.' + k for k in keys),
+               differences=differences, source=SOURCE, join=join,
+               changed=changed, updates=updates)
+
+
+def build_snapshot_sql(table, keys, columns):
+    """Replace the snapshot of the machine with the source values"""
+    updates = ',\n'.join('{0} = excluded.{0}'.format(c) for c in columns)
+    return '''
+        INSERT INTO merged_{table} (machine_id, {keys}, {columns})
+        SELECT :machine, {keys}, {values} FROM {source}.{table} WHERE true
+        ON CONFLICT(machine_id, {keys}) DO UPDATE SET
+            {updates}
+    '''.format(table=table, keys=', '.join(keys), columns=', '.join(columns),
+               values=', '.join('COALESCE({}, 0)'.format(c) for c in columns),
+               source=SOURCE, updates=updates)
+
+
+def fold_vanished_buttons(conn, machine_id):
+    """Move the days the source folded into months to the monthly snapshot
+
+    Maintenance on the source replaces old mouse_buttons days with
+    mouse_buttons_monthly rows. Days merged before are already in the
+    target, so their snapshot counts move to the month they were folded
+    into and only the rest of the new monthly row gets added.
+    """
+    vanished = '''
+        machine_id = :machine AND NOT EXISTS (
+            SELECT 1 FROM {}.mouse_buttons s
+            WHERE s.date = m.date AND s.button = m.button)
+    '''.format(SOURCE)
+    parameters = {'machine': machine_id}
+    conn.execute('''
+        INSERT INTO merged_mouse_buttons_monthly
+            (machine_id, month, button, count)
+        SELECT :machine, substr(m.date, 1, 7) || '-01', m.button,
+               SUM(m.count)
+        FROM merged_mouse_buttons m
+        WHERE {}
+        GROUP BY 2, 3
+        ON CONFLICT(machine_id, month, button) DO UPDATE SET
+            count = count + excluded.count
+    '''.format(vanished), parameters)
+    conn.execute('''
+        DELETE FROM merged_mouse_buttons AS m WHERE {}
+    '''.format(vanished), parameters)
+
+
+def get_source_keys_sql(conn):
+    """SELECT of the source (name, count) key totals"""
+    columns = [row[1] for row in conn.execute(
+        'PRAGMA {}.table_info(keyboard_keys)'.format(SOURCE))]
+    if 'key_name' in columns:
+        # Source from before key names were interned
+        return '''
+            SELECT key_name AS name, count FROM {}.keyboard_keys
+        '''.format(SOURCE)
+    return '''
+        SELECT k.name, s.count FROM {0}.keyboard_keys s
+        JOIN {0}.key_names k ON k.id = s.key_id
+    '''.format(SOURCE)
+
+
+def merge_keyboard_keys(conn, machine_id):
+    """Add source key counts, matching keys by name across databases
+
+    Returns:
+        Number of keys whose count changed
+    """
+    source_keys = get_source_keys_sql(conn)
+    conn.execute('''
+        INSERT OR IGNORE INTO key_names (name)
+        SELECT name FROM ({}) WHERE true
+    '''.format(source_keys))
+    changed = conn.execute('''
+        INSERT INTO keyboard_keys (key_id, count)
+        SELECT key_names.id, source_keys.count - COALESCE(m.count, 0)
+        FROM ({}) AS source_keys
+        JOIN key_names ON key_names.name = source_keys.name
+        LEFT JOIN merged_keyboard_keys m
+            ON m.machine_id = :machine AND m.name = source_keys.name
+        WHERE source_keys.count != COALESCE(m.count, 0)
+        ON CONFLICT(key_id) DO UPDATE SET
+            count = count + excluded.count,
+            updated_at = CURRENT_TIMESTAMP
+    '''.format(source_keys), {'machine': machine_id}).rowcount
+    record_keyboard_keys(conn, machine_id)
+    return changed
+
+
+def record_keyboard_keys(conn, machine_id):
+    """Replace the key snapshot of the machine with the source totals"""
+    conn.execute('''
+        INSERT INTO merged_keyboard_keys (machine_id, name, count)
+        SELECT :machine, name, count FROM ({}) WHERE true
+        ON CONFLICT(machine_id, name) DO UPDATE SET count = excluded.count
+    '''.format(get_source_keys_sql(conn)), {'machine': machine_id})
+
+
+def merge_keyboard_daily(conn, machine_id):
+    """Add source per-day keycode counts slot by slot
+
+    Returns:
+        Number of days whose counts changed
+    """
+    rows = conn.execute('''
+        SELECT s.date, s.counts, m.counts AS merged, t.counts AS target
+        FROM {}.keyboard_daily s
+        LEFT JOIN merged_keyboard_daily m
+            ON m.machine_id = ? AND m.date = s.date
+        LEFT JOIN keyboard_daily t ON t.date = s.date
+        WHERE m.counts IS NOT s.counts
+    '''.format(SOURCE), (machine_id,)).fetchall()
+    for date, counts, merged, target in rows:
+        # target + (source - snapshot), per keycode
+        total = [max(0, t + c - m) for t, c, m in zip(
+            unpack_counts(target or b''), unpack_counts(counts),
+            unpack_counts(merged or b''))]
+        conn.execute('''
+            INSERT INTO keyboard_daily (date, counts) VALUES (?, ?)
+            ON CONFLICT(date) DO UPDATE SET counts = excluded.counts
+        ''', (date, pack_counts(total)))
+        conn.execute('''
+            INSERT INTO merged_keyboard_daily (machine_id, date, counts)
+            VALUES (?, ?, ?)
+            ON CONFLICT(machine_id, date) DO UPDATE SET
+                counts = excluded.counts
+        ''', (machine_id, date, counts))
+    merge_keycodes(conn)
+    return len(rows)
+
+
+def merge_keycodes(conn):
+    """Take keycode labels from the source for keycodes never seen here"""
+    if not source_has_table(conn, 'keycodes'):
+        return
+    conn.execute('''
+        INSERT OR IGNORE INTO key_names (name)
+        SELECT k.name FROM {0}.keycodes s
+        JOIN {0}.key_names k ON k.id = s.key_id
+    '''.format(SOURCE))
+    conn.execute('''
+        INSERT OR IGNORE INTO keycodes (keycode, key_id)
+        SELECT s.keycode, key_names.id FROM {0}.keycodes s
+        JOIN {0}.key_names k ON k.id = s.key_id
+        JOIN key_names ON key_names.name = k.name
+    '''.format(SOURCE))
+
+
+def source_has_table(conn, table):
+    row = conn.execute(
+        'SELECT name FROM {}.sqlite_master WHERE type = ? AND name = ?'.format(
+            SOURCE), ('table', table)).fetchone()
+    return row is not None
+
+
+def get_source_machine_id(conn, filename):
+    """Machine ID of the attached source
+
+    Databases created before machine IDs existed are identified by a hash
+    of their path instead.
+    """
+    if source_has_table(conn, 'metadata'):
+        row = conn.execute(
+            "SELECT value FROM {}.metadata WHERE key = 'machine-id'".format(
+                SOURCE)).fetchone()
+        if row is not None:
+            return row[0]
+    path = os.path.realpath(filename).encode('utf-8')
+    return 'path-' + hashlib.sha1(path).hexdigest()
+
+
+def merge_databases(sources, db=None):
+    """Add what every source recorded since its last merge to the target
+
+    Args:
+        sources: Paths of the databases to merge
+        db: Target Database (defaults to the user database)
+
+    Returns:
+        List of (source, status) tuples, status being 'merged',
+        'up to date', 'baseline recorded', 'same database' or 'same
+        machine' (a copy of the target, see README to give it a new ID)
+    """
+    db = db if db is not None else Database()
+    target_id = db.get_machine_id()
+    results = []
+    conn = db.connect()
+    # ATTACH/DETACH are not allowed inside a transaction
+    conn.isolation_level = None
+    try:
+        for filename in sources:
+            if not os.path.exists(filename):
+                raise FileNotFoundError(filename)
+            if os.path.realpath(filename) == os.path.realpath(db.db_file):
+                results.append((filename, 'same database'))
+                continue
+            conn.execute('ATTACH DATABASE ? AS {}'.format(SOURCE),
+                         (filename,))
+            try:
+                results.append((filename, merge_source(
+                    conn, filename, target_id)))
+            finally:
+                conn.execute('DETACH DATABASE {}'.format(SOURCE))
+    finally:
+        conn.close()
+        db.invalidate_cache()
+    return results
+
+
+def has_snapshot(conn, machine_id):
+    for table in ('daily_stats', 'mouse_buttons', 'mouse_buttons_monthly',
+                  'keyboard_keys', 'keyboard_daily'):
+        row = conn.execute(
+            'SELECT 1 FROM merged_{} WHERE machine_id = ? LIMIT 1'.format(
+                table), (machine_id,)).fetchone()
+        if row is not None:
+            return True
+    return False
+
+
+def merge_source(conn, filename, target_id):
+    """Merge the attached source in a single transaction"""
+    machine_id = get_source_machine_id(conn, filename)
+    if machine_id == target_id:
+        # Another file with the target's ID: habits.db was copied
+        return 'same machine'
+    # Merged in full before snapshots existed: its data is already in,
+    # only record where it stands now
+    baseline_only = conn.execute(
+        'SELECT 1 FROM merged_sources WHERE machine_id = ?',
+        (machine_id,)).fetchone() is not None and \
+        not has_snapshot(conn, machine_id)
+    parameters = {'machine': machine_id}
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        changed = 0
+        if source_has_table(conn, 'mouse_buttons') and \
+                source_has_table(conn, 'mouse_buttons_monthly'):
+            fold_vanished_buttons(conn, machine_id)
+        for table, keys, columns in MERGED_TABLES:
+            if source_has_table(conn, table):
+                if not baseline_only:
+                    changed += conn.execute(
+                        build_merge_sql(table, keys, columns),
+                        parameters).rowcount
+                conn.execute(build_snapshot_sql(table, keys, columns),
+                             parameters)
+        if baseline_only:
+            if source_has_table(conn, 'keyboard_keys'):
+                record_keyboard_keys(conn, machine_id)
+            if source_has_table(conn, 'keyboard_daily'):
+                conn.execute('''
+                    INSERT OR REPLACE INTO merged_keyboard_daily
+                        (machine_id, date, counts)
+                    SELECT ?, date, counts FROM {}.keyboard_daily
+                '''.format(SOURCE), (machine_id,))
+        else:
+            if source_has_table(conn, 'keyboard_keys'):
+                changed += merge_keyboard_keys(conn, machine_id)
+            if source_has_table(conn, 'keyboard_daily'):
+                changed += merge_keyboard_daily(conn, machine_id)
+        conn.execute('''
+            INSERT INTO merged_sources (machine_id, source)
+            VALUES (?, ?)
+            ON CONFLICT(machine_id) DO UPDATE SET
+                source = excluded.source,
+                merged_at = CURRENT_TIMESTAMP
+        ''', (machine_id, os.path.abspath(filename)))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    if baseline_only:
+        return 'baseline recorded'
+    return 'merged' if changed else 'up to date'
@@ -28,6 +28,13 @@ def migrate_keyboard_to_total():
         conn.close()
         return
 
+    # Totals already, either by name or by key_names id
+    cursor.execute("PRAGMA table_info(keyboard_keys)")
+    if 'date' not in [row['name'] for row in cursor.fetchall()]:
+        print("keyboard_keys already stores totals. Nothing to migrate.")
+        conn.close()
+        return
+
     print("Starting migration...")
 
     # Get current data summary
@@ -3,66 +3,225 @@
 
 """
 Migration script to convert JSON configuration to SQLite database
+
+The legacy habits.conf is parsed incrementally, one day at a time, and
+loaded with executemany() inside a single transaction. Running it again
+is harmless: rows are merged with MAX() and an unchanged file is skipped.
 """
 
 import json
-import codecs
 import os
+import shutil
 from database import Database
 from config import CONFIG_FILE
 
-def migrate_json_to_sqlite():
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 1000
+
+# Metadata key remembering which habits.conf (size:mtime) was imported
+IMPORT_MARKER_KEY = 'legacy-import'
+
+WHITESPACE = ' \t\r\n'
+
+
+class JSONStream(object):
+    """Incremental reader for nested JSON objects
+
+    Only the value currently being decoded is held in memory, so a
+    habits.conf with years of stats is read in constant space.
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Append the next chunk, dropping what was already consumed"""
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it"""
+        while True:
+            while self.pos < len(self.buffer) and \
+                    self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError('Unexpected end of JSON data')
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected {!r} at offset {}'.format(
+                char, self.pos))
+        self.pos += 1
+
+    def value(self):
+        """Decode and return the complete value at the current position"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # A number ending the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """Yield the keys of the object at the current position
+
+        After each key the caller must consume its value, either with
+        value() or by iterating members() again for a nested object.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == '}':
+                return
+            if separator != ',':
+                raise ValueError('Expected \',\' or \'}}\' at offset {}'.format(
+                    self.pos - 1))
+
+
+def iter_legacy_config(f):
+    """Yield ('stats', date, values) and ('preferences', key, value) tuples"""
+    stream = JSONStream(f)
+    for section in stream.members():
+        if section == 'stats':
+            for date in stream.members():
+                yield 'stats', date, stream.value()
+        elif section == 'preferences':
+            for key in stream.members():
+                yield 'preferences', key, stream.value()
+        else:
+            stream.value()
+
+
+def get_file_signature(filename):
+    stat = os.stat(filename)
+    return '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+
+def import_legacy_config(config_file=CONFIG_FILE, db=None, force=False):
+    """Load a legacy habits.conf into the database in one transaction
+
+    Args:
+        config_file: Path of the JSON configuration
+        db: Target Database (defaults to the user database)
+        force: Import even if this exact file was imported before
+
+    Returns:
+        Tuple (days, preferences) imported, or None if skipped
+    """
+    db = db if db is not None else Database()
+    signature = get_file_signature(config_file)
+    if not force and db.get_metadata(IMPORT_MARKER_KEY) == signature:
+        return None
+
+    stats_sql = '''
+        INSERT INTO daily_stats (date, distance, clicks, keys)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(date) DO UPDATE SET
+            distance = MAX(distance, excluded.distance),
+            clicks = MAX(clicks, excluded.clicks),
+            keys = MAX(keys, excluded.keys),
+            updated_at = CURRENT_TIMESTAMP
+    '''
+    preferences_sql = '''
+        INSERT INTO preferences (key, value)
+        VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    '''
+
+    days = 0
+    preferences = 0
+    stats_batch = []
+    preferences_batch = []
+    conn = db.connect()
+    try:
+        with conn, open(config_file, 'r', encoding='utf-8') as f:
+            for section, key, value in iter_legacy_config(f):
+                if section == 'stats':
+                    # The legacy format stores clicks as 'clics'
+                    stats_batch.append((
+                        key,
+                        value.get('distance', 0),
+                        value.get('clics', value.get('clicks', 0)),
+                        value.get('keys', 0)))
+                    if len(stats_batch) >= BATCH_SIZE:
+                        conn.executemany(stats_sql, stats_batch)
+                        days += len(stats_batch)
+                        stats_batch = []
+                else:
+                    preferences_batch.append((key, str(value)))
+                    if len(preferences_batch) >= BATCH_SIZE:
+                        conn.executemany(preferences_sql, preferences_batch)
+                        preferences += len(preferences_batch)
+                        preferences_batch = []
+
+            conn.executemany(stats_sql, stats_batch)
+            conn.executemany(preferences_sql, preferences_batch)
+            days += len(stats_batch)
+            preferences += len(preferences_batch)
+            # In the same transaction, so a failed import is retried
+            conn.execute('''
+                INSERT INTO metadata (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            ''', (IMPORT_MARKER_KEY, signature))
+    finally:
+        conn.close()
+        db.invalidate_cache()
+    return days, preferences
+
+
+def migrate_json_to_sqlite(config_file=CONFIG_FILE, force=False):
     """Migrate existing JSON data to SQLite database"""
 
     # Check if JSON config exists
-    if not os.path.exists(CONFIG_FILE):
+    if not os.path.exists(config_file):
         print("No JSON config file found. Nothing to migrate.")
         return
 
-    # Read JSON data
-    print(f"Reading data from: {CONFIG_FILE}")
-    with codecs.open(CONFIG_FILE, 'r', 'utf-8') as f:
-        data = json.loads(f.read())
-
-    # Initialize database
+    print(f"Reading data from: {config_file}")
     db = Database()
+    result = import_legacy_config(config_file, db, force)
+    if result is None:
+        print("This file was already migrated. Nothing to do.")
+        return
 
-    # Migrate stats
-    if 'stats' in data:
-        print("\nMigrating statistics...")
-        for date, stats in data['stats'].items():
-            distance = stats.get('distance', 0)
-            clicks = stats.get('clicks', 0)
-            keys = stats.get('keys', 0)
-
-            db.save_daily_stat(date, distance, clicks, keys)
-            print(f"  Migrated {date}: distance={distance}, clicks={clicks}, keys={keys}")
-
-    # Migrate preferences
-    if 'preferences' in data:
-        print("\nMigrating preferences...")
-        for key, value in data['preferences'].items():
-            # Convert value to string for storage
-            value_str = str(value)
-            db.save_preference(key, value_str)
-            print(f"  Migrated {key}: {value_str}")
-
+    days, preferences = result
     print("\n✅ Migration completed successfully!")
     print(f"Database file: {db.db_file}")
-
-    # Show summary
-    all_stats = db.get_all_stats()
-    all_prefs = db.get_all_preferences()
-
     print(f"\nSummary:")
-    print(f"  - {len(all_stats)} days of statistics migrated")
-    print(f"  - {len(all_prefs)} preferences migrated")
+    print(f"  - {days} days of statistics migrated")
+    print(f"  - {preferences} preferences migrated")
 
     # Backup original JSON file
-    backup_file = CONFIG_FILE + '.backup'
+    backup_file = config_file + '.backup'
     if not os.path.exists(backup_file):
-        import shutil
-        shutil.copy2(CONFIG_FILE, backup_file)
+        shutil.copy2(config_file, backup_file)
         print(f"\n📋 Original JSON backed up to: {backup_file}")
 
 
@@ -39,8 +39,20 @@ import math
 from Xlib import X, XK, display
 from Xlib.ext import record
 from Xlib.protocol import rq
-from configurator import Configuration
-from threading import Thread
+from database import Database
+from threading import Lock, Thread
+
+# X keysym -> name, built once from Xlib.XK (see get_keysym_names)
+keysym_names = {}
+
+
+def get_keysym_names():
+    if not keysym_names:
+        # dir() is sorted, so the first alias of a keysym wins as before
+        for name in dir(XK):
+            if name[:3] == "XK_":
+                keysym_names.setdefault(getattr(XK, name), name[3:])
+    return keysym_names
 
 
 class Monitor(Thread):
@@ -51,20 +63,36 @@ class Monitor(Thread):
         self.local_dpy = display.Display()
         self.record_dpy = display.Display()
         self.display = Gdk.Display.get_default()
+        self.last_activity = time.time()
         self.data = {}
+        # Counter values already written, per day, so save() only writes
+        # what changed since the previous save
+        self.flushed = {}
+        # Key name produced by each keycode seen in this session
+        self.keycode_names = {}
+        # Held while saving, so readers never see a half-applied save
+        # (see livestats.py)
+        self.save_lock = Lock()
         day = time.strftime('%Y-%m-%d', time.localtime())
-        configuration = Configuration()
-        stats = configuration.get('stats')
-        if day in stats:
-            self.data[day] = stats[day]
+        # Only today's row and two preferences are needed, so the full
+        # history is not loaded through Configuration
+        db = Database()
+        db.seed_key_names(sorted(set(get_keysym_names().values())))
+        stats = db.get_daily_stat(day)
+        if stats is not None:
+            del stats['date']
+            self.data[day] = dict(stats)
+            self.flushed[day] = dict(stats)
 
-        # Track what's already in self.data to avoid double-counting on first save
-        self.session_keyboard_data = {}
-        if day in self.data:
-            for key, value in self.data[day].items():
-                if key.startswith('Key-'):
-                    key_name = key.split('-', 1)[1]
-                    self.session_keyboard_data[key_name] = value
+        self.collector = None
+        self.collector_only = False
+        collector_address = db.get_preference('collector-address')
+        if collector_address:
+            from collector import CollectorClient
+            self.collector = CollectorClient(
+                collector_address, machine_id=db.get_machine_id())
+            self.collector_only = \
+                db.get_preference('collector-only') == 'True'
 
         # Check if the extension is present
         if not self.record_dpy.has_extension("RECORD"):
@@ -100,41 +128,58 @@ class Monitor(Thread):
         self.record_dpy.record_free_context(self.ctx)
         self._running = False
 
+    def get_pending(self):
+        """Counter increments not saved yet, as {day: {counter: delta}}"""
+        pending = {}
+        for day, values in list(self.data.items()):
+            flushed = self.flushed.get(day, {})
+            deltas = {}
+            for key, value in list(values.items()):
+                delta = value - flushed.get(key, 0)
+                if delta:
+                    deltas[key] = delta
+            if deltas:
+                pending[day] = deltas
+        return pending
+
+    def mark_flushed(self, pending):
+        for day, deltas in pending.items():
+            flushed = self.flushed.setdefault(day, {})
+            for key, delta in deltas.items():
+                flushed[key] = flushed.get(key, 0) + delta
+
     def save(self):
-        from database import Database
-        configuration = Configuration()
-        stats = configuration.get('stats')
-        db = Database()
+        with self.save_lock:
+            pending = self.get_pending()
+            if not pending:
+                return
+            if self.collector is not None:
+                # Only spooled here, sent by a background thread
+                self.collector.push(pending, dict(self.keycode_names))
+            if not self.collector_only:
+                Database().apply_deltas(pending, dict(self.keycode_names))
+            self.mark_flushed(pending)
+            self.evict_flushed()
+
+    def evict_flushed(self):
+        """Forget saved days before yesterday
 
-        # First, sum up all keyboard keys across all days in current session
-        keyboard_totals = {}
-        for day in self.data:
-            stats[day] = self.data[day]
-
-            # Save individual button counts (per-day)
-            for key, value in self.data[day].items():
-                if key.startswith('Button-'):
-                    button_num = int(key.split('-')[1])
-                    db.save_mouse_button(day, button_num, value)
-                elif key.startswith('Key-'):
-                    key_name = key.split('-', 1)[1]
-                    keyboard_totals[key_name] = keyboard_totals.get(key_name, 0) + value
-
-        # Save keyboard keys (only the delta since last save)
-        for key_name, total_count in keyboard_totals.items():
-            previously_saved = self.session_keyboard_data.get(key_name, 0)
-            delta = total_count - previously_saved
-            if delta > 0:
-                db.save_keyboard_key(key_name, delta)
-                self.session_keyboard_data[key_name] = total_count
-
-        configuration.set('stats', stats)
-        configuration.save()
+        Today and yesterday (which may still get a late event around
+        midnight) stay in memory; older days are dropped once everything
+        in them has been saved, so save() and memory use do not grow with
+        uptime.
+        """
+        yesterday = time.strftime('%Y-%m-%d',
+                                  time.localtime(time.time() - 86400))
+        for day in list(self.data):
+            if day < yesterday and self.data[day] == self.flushed.get(day):
+                del self.data[day]
+                del self.flushed[day]
 
     def lookup_keysym(self, keysym):
-        for name in dir(XK):
-            if name[:3] == "XK_" and getattr(XK, name) == keysym:
-                return name[3:]
+        name = get_keysym_names().get(keysym)
+        if name is not None:
+            return name
         return "[%d]" % keysym
 
     def record_callback(self, reply):
@@ -145,6 +190,7 @@ class Monitor(Thread):
             return
         if not len(reply.data) or reply.data[0] < 2:
             return
+        self.last_activity = time.time()
         data = reply.data
         while len(data):
             event, data = rq.EventField(None).parse_binary_value(
@@ -155,6 +201,10 @@ class Monitor(Thread):
                     # Track individual keys
                     key_name = self.lookup_keysym(keysym)
                     self.inc_data('Key-{}'.format(key_name), 1)
+                    # Per-day counts are stored by keycode
+                    self.inc_data('Code-{}'.format(event.detail), 1)
+                    if self.keycode_names.get(event.detail) != key_name:
+                        self.keycode_names[event.detail] = key_name
                     # Also keep total keys for backward compatibility
                     self.inc_data('keys', 1)
             elif event.type == X.ButtonPress:
@@ -185,19 +235,25 @@ class Monitor(Thread):
 
     def inc_data(self, key, value):
         day = time.strftime('%Y-%m-%d', time.localtime())
-        if day not in self.data:
-            self.data[day] = {}
-        if key not in self.data[day]:
-            self.data[day][key] = 0
-        self.data[day][key] += value
+        values = self.data.setdefault(day, {})
+        values[key] = values.get(key, 0) + value
 
     def get_data(self, key):
         day = time.strftime('%Y-%m-%d', time.localtime())
         if day in self.data:
-            if key in self.data[day].keys:
+            if key in self.data[day]:
                 return self.data[day][key]
         return 0
 
+    def get_today(self):
+        """Today's counters, including what has not been saved yet"""
+        day = time.strftime('%Y-%m-%d', time.localtime())
+        return day, dict(self.data.get(day, {}))
+
+    def get_idle_seconds(self):
+        """Seconds since the last keyboard or mouse event"""
+        return time.time() - self.last_activity
+
     def is_running(self):
         return self._running
 
@@ -114,12 +114,49 @@ class Preferences(BaseDialog):
         self.keys_color.set_rgba(color)
         self.grid.attach(self.keys_color, 1, 9, 1, 1)
 
+        self.grid.attach(Gtk.Separator(), 0, 10, 2, 1)
+
+        label = Gtk.Label(_('Chart'))
+        label.set_alignment(0, 0.5)
+        self.grid.attach(label, 0, 11, 1, 1)
+
+        renderer_store = Gtk.ListStore(str, str)
+        renderer_store.append([_('Highcharts (WebKit)'), 'webkit'])
+        renderer_store.append([_('Native (lighter)'), 'cairo'])
+
+        self.chart_renderer = Gtk.ComboBox.new()
+        self.chart_renderer.set_model(renderer_store)
+        cell2 = Gtk.CellRendererText()
+        self.chart_renderer.pack_start(cell2, True)
+        self.chart_renderer.add_attribute(cell2, 'text', 0)
+        self.grid.attach(self.chart_renderer, 1, 11, 1, 1)
+
+        label = Gtk.Label(_('Today\'s counters'))
+        label.set_alignment(0, 0.5)
+        self.grid.attach(label, 0, 12, 1, 1)
+
+        counters_store = Gtk.ListStore(str, str)
+        counters_store.append([_('Hidden'), 'off'])
+        counters_store.append([_('In the menu'), 'menu'])
+        counters_store.append([_('In the menu and panel'), 'label'])
+
+        self.live_counters = Gtk.ComboBox.new()
+        self.live_counters.set_model(counters_store)
+        cell3 = Gtk.CellRendererText()
+        self.live_counters.pack_start(cell3, True)
+        self.live_counters.add_attribute(cell3, 'text', 0)
+        self.grid.attach(self.live_counters, 1, 12, 1, 1)
+
     def load(self):
         configuration = Configuration()
         preferences = configuration.get('preferences')
         self.theme_light.set_active(preferences.get('theme-light'))
         self.start_actived.set_active(preferences.get('start-actived'))
         select_value_in_combo(self.units, preferences.get('units'))
+        select_value_in_combo(self.chart_renderer,
+                              preferences.get('chart-renderer'))
+        select_value_in_combo(self.live_counters,
+                              preferences.get('live-counters'))
 
         color = Gdk.RGBA()
         color.parse(preferences['distance-color'])
@@ -142,6 +179,10 @@ class Preferences(BaseDialog):
         preferences['theme-light'] = self.theme_light.get_active()
         preferences['start-actived'] = self.start_actived.get_active()
         preferences['units'] = get_selected_value_in_combo(self.units)
+        preferences['chart-renderer'] = get_selected_value_in_combo(
+            self.chart_renderer)
+        preferences['live-counters'] = get_selected_value_in_combo(
+            self.live_counters)
 
         preferences['distance-color'] = convert_rgb2hex(
             self.distance_color.get_rgba())
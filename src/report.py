@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Report - Render statistics charts and CSV files without GTK or WebKit
+#
+# Every database is read through a single connection, one query per date
+# range; the charts are then drawn with Cairo (see chart.py) in a pool of
+# worker processes. Used by 'habits report'.
+
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from config import PARAMS
+from database import connect_read_only
+from downsample import bucket_columns, bucket_subtitle
+
+FORMATS = ('png', 'svg', 'csv')
+
+DEFAULT_WIDTH = 900
+DEFAULT_HEIGHT = 600
+
+# Range covering the whole history
+ALL_TIME = ('0000-00-00', '9999-99-99')
+
+
+def parse_range(text):
+    """'YYYY-MM-DD:YYYY-MM-DD' or 'all' to a (start, end) tuple"""
+    if text == 'all':
+        return ALL_TIME
+    start, separator, end = text.partition(':')
+    if not separator or not start or not end:
+        raise ValueError(
+            "Invalid range '{}', expected FROM:TO or 'all'".format(text))
+    return start, end
+
+
+def get_range_name(date_range):
+    if date_range == ALL_TIME:
+        return 'all'
+    return '{}_{}'.format(*date_range)
+
+
+def read_ranges(db_file, ranges):
+    """Read the daily stats of every range through one connection
+
+    Returns:
+        Tuple (preferences, {range: (days, clicks, keys)})
+    """
+    conn = connect_read_only(db_file)
+    try:
+        preferences = dict(PARAMS['preferences'])
+        if conn.execute('''
+                SELECT 1 FROM sqlite_master
+                WHERE type = 'table' AND name = 'preferences'
+                ''').fetchone():
+            preferences.update(conn.execute(
+                'SELECT key, value FROM preferences').fetchall())
+        data = {}
+        for start, end in ranges:
+            rows = conn.execute('''
+                SELECT date, clicks, keys
+                FROM daily_stats
+                WHERE date BETWEEN ? AND ?
+                ORDER BY date
+            ''', (start, end)).fetchall()
+            data[(start, end)] = ([row['date'] for row in rows],
+                                  [row['clicks'] for row in rows],
+                                  [row['keys'] for row in rows])
+    finally:
+        conn.close()
+    return preferences, data
+
+
+def get_source_names(db_files):
+    """A distinct file name prefix per database
+
+    The file name without extension, with as many parent directories as
+    needed to tell the databases apart, so many users' habits.db files
+    do not overwrite each other's reports.
+    """
+    paths = [tuple(os.path.splitext(os.path.abspath(db_file))[0]
+                   .strip(os.sep).split(os.sep)) for db_file in db_files]
+    if len(set(paths)) < len(paths):
+        raise ValueError('The same database is listed more than once')
+    depth = 1
+    while True:
+        names = ['-'.join(path[-depth:]) for path in paths]
+        if len(set(names)) == len(names):
+            return names
+        depth += 1
+
+
+def render(job):
+    """Write one report file; runs in a worker process
+
+    Args:
+        job: Dictionary with 'format', 'output', 'width', 'height',
+            'title', 'subtitle', 'days', 'clicks', 'keys' and 'colors'
+
+    Returns:
+        The path written
+    """
+    if job['format'] == 'csv':
+        with open(job['output'], 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(('date', 'clicks', 'keys'))
+            writer.writerows(zip(job['days'], job['clicks'], job['keys']))
+        return job['output']
+
+    # Only chart formats need Cairo
+    import cairo
+    from chart import ColumnChart, Series
+    width = job['width']
+    height = job['height']
+    days, (clicks, keys), bucket = bucket_columns(
+        job['days'], [job['clicks'], job['keys']], width)
+    subtitle = bucket_subtitle(job['subtitle'], bucket)
+    chart = ColumnChart(job['title'], subtitle, days, [
+        Series('Clicks', job['colors']['clics'], clicks, ' clicks'),
+        Series('Keys', job['colors']['keys'], keys, ' keys'),
+    ])
+    if job['format'] == 'svg':
+        surface = cairo.SVGSurface(job['output'], width, height)
+        chart.draw(cairo.Context(surface), width, height)
+        surface.finish()
+    else:
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        chart.draw(cairo.Context(surface), width, height)
+        surface.write_to_png(job['output'])
+    return job['output']
+
+
+def build_jobs(db_files, ranges, formats, directory, width=DEFAULT_WIDTH,
+               height=DEFAULT_HEIGHT):
+    """One job per database, range and format"""
+    jobs = []
+    for db_file, name in zip(db_files, get_source_names(db_files)):
+        preferences, data = read_ranges(db_file, ranges)
+        for date_range in ranges:
+            days, clicks, keys = data[date_range]
+            if date_range == ALL_TIME:
+                subtitle = 'Mouse and keyboard - All time'
+            else:
+                subtitle = 'Mouse and keyboard - {} to {}'.format(*date_range)
+            for fmt in formats:
+                jobs.append({
+                    'format': fmt,
+                    'output': os.path.join(directory, '{}-{}.{}'.format(
+                        name, get_range_name(date_range), fmt)),
+                    'width': width,
+                    'height': height,
+                    'title': 'Habits',
+                    'subtitle': subtitle,
+                    'days': days,
+                    'clicks': clicks,
+                    'keys': keys,
+                    'colors': {'clics': preferences['clics-color'],
+                               'keys': preferences['keys-color']},
+                })
+    return jobs
+
+
+def run_reports(db_files, ranges, formats, directory='.',
+                width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, workers=None):
+    """Render every report, charts in parallel processes
+
+    Returns:
+        List of the paths written
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    jobs = build_jobs(db_files, ranges, formats, directory, width, height)
+    if len(jobs) == 1 or workers == 1:
+        return [render(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(render, jobs))
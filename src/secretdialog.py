@@ -12,14 +12,16 @@ except Exception as e:
     exit(-1)
 from gi.repository import Gtk
 from basedialog import BaseDialog
-from configurator import Configuration
-from database import Database
+from database import Database, query_cache
 
 
 class SecretDialog(BaseDialog):
     """Dialog to show total combined statistics across all days"""
 
-    def __init__(self):
+    def __init__(self, stats=None):
+        """stats: object with the Database read methods, such as
+        LiveStats (defaults to the user database)"""
+        self.stats = stats if stats is not None else Database()
         BaseDialog.__init__(self, 'Secret Statistics', None,
                             ok_button=False, cancel_button=False,
                             modal=False)
@@ -27,24 +29,17 @@ class SecretDialog(BaseDialog):
 
     def init_ui(self):
         BaseDialog.init_ui(self)
+        self.start_loading(self.fetch_data, self.populate)
 
-        # Load statistics
-        configuration = Configuration()
-        stats = configuration.get('stats')
+    def fetch_data(self):
+        """All-time totals, read on a worker thread"""
+        return self.stats.get_totals()
 
-        # Calculate totals
-        total_clicks = 0
-        total_keys = 0
-        total_distance = 0
-        total_days = len(stats)
-
-        for day in stats:
-            if 'clics' in stats[day]:
-                total_clicks += stats[day]['clics']
-            if 'keys' in stats[day]:
-                total_keys += stats[day]['keys']
-            if 'distance' in stats[day]:
-                total_distance += stats[day]['distance']
+    def populate(self, totals):
+        total_clicks = totals['clics']
+        total_keys = totals['keys']
+        total_distance = totals['distance']
+        total_days = totals['days']
 
         # Convert distance to meters and kilometers
         distance_meters = total_distance / 1000.0
@@ -138,6 +133,20 @@ class SecretDialog(BaseDialog):
         days_value.set_halign(Gtk.Align.END)
         grid.attach(days_value, 1, row, 1, 1)
 
+        # Query cache counters, for this process
+        row += 1
+        cache = query_cache.stats()
+        cache_label = Gtk.Label()
+        cache_label.set_markup('<b>Query Cache:</b>')
+        cache_label.set_halign(Gtk.Align.START)
+        grid.attach(cache_label, 0, row, 1, 1)
+
+        cache_value = Gtk.Label()
+        cache_value.set_markup(
+            f'<span>{cache["hits"]:,} hits, {cache["misses"]:,} misses</span>')
+        cache_value.set_halign(Gtk.Align.END)
+        grid.attach(cache_value, 1, row, 1, 1)
+
         # Add close button
         row += 1
         close_button = Gtk.Button.new_with_label('Close')
@@ -145,7 +154,7 @@ class SecretDialog(BaseDialog):
         close_button.set_margin_top(20)
         grid.attach(close_button, 0, row, 2, 1)
 
-        self.grid.attach(grid, 0, 0, 1, 1)
+        self.show_content(grid)
 
     def close(self):
         self.hide()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Startup benchmark for the indicator: time until the tray icon is up and
+# resident memory once idle
+#
+# Every run starts the indicator in a fresh process with a temporary HOME,
+# so it gets a new configuration and database. The child reports when the
+# GTK main loop first goes idle (the icon is visible by then), waits, then
+# reports its RSS and which of the lazily imported modules got loaded.
+# The medians are printed; --max-startup-ms and --max-rss-mb make it exit
+# with status 1 when they are exceeded, so a regression is caught.
+# --compare REV also measures another git revision, checked out in a
+# temporary worktree, so before and after figures come from one command.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Modules indicator.py only imports on first use of a menu item
+DEFERRED_MODULES = (
+    'graph', 'cairograph', 'preferences', 'secretdialog',
+    'buttonstatsdialog', 'keyboardstatsdialog', 'daterangedialog',
+    'backup', 'ramstore', 'webbrowser', 'gi.repository.WebKit2',
+)
+
+CHILD = '''
+import json, os, sys, time
+from gi.repository import GLib
+sys.path.insert(0, {src!r})
+import indicator
+
+visible = []
+
+
+def on_idle():
+    visible.append(time.time())
+    GLib.timeout_add({idle_ms}, on_settled)
+    return False
+
+
+def on_settled():
+    rss = 0
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+    print(json.dumps({{
+        'visible': visible[0],
+        'rss': rss,
+        'loaded': [name for name in {deferred!r} if name in sys.modules],
+    }}), flush=True)
+    os._exit(0)
+
+
+GLib.idle_add(on_idle)
+indicator.main()
+'''
+
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_once(src, idle_ms):
+    """Start one indicator, return (startup seconds, RSS bytes, loaded)"""
+    source = CHILD.format(src=src, idle_ms=idle_ms,
+                          deferred=DEFERRED_MODULES)
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home)
+        start = time.time()
+        output = subprocess.run([sys.executable, '-c', source], env=env,
+                                stdout=subprocess.PIPE, check=True,
+                                timeout=60 + idle_ms / 1000).stdout
+    # The indicator may print before the report, which is the last line
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    return result['visible'] - start, result['rss'], result['loaded']
+
+
+def measure(label, src, runs, idle_ms):
+    """Print and return the median startup ms, RSS MB and loaded modules"""
+    startups = []
+    memory = []
+    loaded = set()
+    for _ in range(runs):
+        startup, rss, modules = run_once(src, idle_ms)
+        startups.append(startup * 1000)
+        memory.append(rss / 1024 / 1024)
+        loaded.update(modules)
+    startup_ms = statistics.median(startups)
+    rss_mb = statistics.median(memory)
+    print('{}:'.format(label))
+    print('  Time to indicator visible: {:.0f} ms (median of {}, '
+          '{:.0f}-{:.0f})'.format(startup_ms, runs, min(startups),
+                                  max(startups)))
+    print('  Idle RSS: {:.1f} MB (median of {}, {:.1f}-{:.1f})'.format(
+        rss_mb, runs, min(memory), max(memory)))
+    if loaded:
+        print('  Loaded at startup: {}'.format(', '.join(sorted(loaded))))
+    return startup_ms, rss_mb, loaded
+
+
+def measure_revision(revision, runs, idle_ms):
+    """Measure the indicator of another git revision"""
+    with tempfile.TemporaryDirectory() as directory:
+        worktree = os.path.join(directory, 'habits')
+        subprocess.run(['git', 'worktree', 'add', '--detach', worktree,
+                        revision], cwd=SRC_DIR, check=True,
+                       stdout=subprocess.DEVNULL)
+        try:
+            return measure(revision, os.path.join(worktree, 'src'), runs,
+                           idle_ms)
+        finally:
+            subprocess.run(['git', 'worktree', 'remove', '--force',
+                            worktree], cwd=SRC_DIR, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--idle-ms', type=int, default=3000,
+                        help='wait after startup before measuring RSS')
+    parser.add_argument('--compare', metavar='REV',
+                        help='also measure this git revision')
+    parser.add_argument('--max-startup-ms', type=float,
+                        help='fail if the median startup is slower')
+    parser.add_argument('--max-rss-mb', type=float,
+                        help='fail if the median idle RSS is larger')
+    args = parser.parse_args()
+
+    if args.compare:
+        before_ms, before_mb, _ = measure_revision(args.compare, args.runs,
+                                                   args.idle_ms)
+    startup_ms, rss_mb, loaded = measure('Working tree', SRC_DIR, args.runs,
+                                         args.idle_ms)
+    if args.compare:
+        print('Change: {:+.0f} ms, {:+.1f} MB'.format(
+            startup_ms - before_ms, rss_mb - before_mb))
+
+    failed = False
+    if loaded:
+        print('Some modules meant to be deferred were loaded at startup')
+        failed = True
+    if args.max_startup_ms is not None and startup_ms > args.max_startup_ms:
+        print('Startup over the {:.0f} ms limit'.format(args.max_startup_ms))
+        failed = True
+    if args.max_rss_mb is not None and rss_mb > args.max_rss_mb:
+        print('Idle RSS over the {:.1f} MB limit'.format(args.max_rss_mb))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
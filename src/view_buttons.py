@@ -56,6 +56,18 @@ def view_buttons():
     else:
         print("  No daily data available yet")
 
+    # Older months are folded into monthly totals by the maintenance
+    monthly_buttons = db.get_monthly_mouse_buttons()
+    if monthly_buttons:
+        print("\n📆 Monthly Breakdown (older data):")
+        print("-" * 60)
+        for month in sorted(monthly_buttons.keys(), reverse=True):
+            print(f"\n  {month[:7]}:")
+            for button_num in sorted(monthly_buttons[month].keys()):
+                button_name = button_names.get(button_num, f"Button {button_num}")
+                count = monthly_buttons[month][button_num]
+                print(f"    {button_name:28s}: {count:,}")
+
     print("\n" + "=" * 60 + "\n")
 
 